@@ -0,0 +1,95 @@
+"""表情命令选项构建的内存分配对比
+
+用法：python benchmarks/parser_options.py [表情数量] [重复次数]
+
+模拟“创建响应器 + 多次查看表情详情”的场景，
+对比每次调用 `ParserOption.option()` 与使用 `get_meme_options` 缓存时的分配情况
+"""
+
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import nonebot
+from nonebot.compat import type_validate_python
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+nonebot.init(localstore_use_cwd=True)
+
+from nonebot_plugin_memes_api.request import MemeInfo, get_meme_options
+
+
+def make_meme(index: int) -> MemeInfo:
+    return type_validate_python(
+        MemeInfo,
+        {
+            "key": f"meme_{index}",
+            "params_type": {
+                "min_images": 1,
+                "max_images": 1,
+                "min_texts": 0,
+                "max_texts": 1,
+                "default_texts": [],
+                "args_type": {
+                    "args_model": {},
+                    "args_examples": [],
+                    "parser_options": [
+                        {
+                            "names": ["-c", "--circle", "圆"],
+                            "args": [{"name": "circle", "value": "bool"}],
+                            "help_text": "是否将图片变为圆形",
+                        },
+                        {
+                            "names": ["-d", "--direction"],
+                            "args": [{"name": "direction", "value": "str"}],
+                            "help_text": "方向",
+                        },
+                        {
+                            "names": ["--name"],
+                            "args": [{"name": "name", "value": "str"}],
+                            "help_text": "名字",
+                        },
+                    ],
+                },
+            },
+            "keywords": [f"表情{index}"],
+            "shortcuts": [],
+            "tags": [],
+            "date_created": datetime(2024, 1, 1),
+            "date_modified": datetime(2024, 1, 1),
+        },
+    )
+
+
+def uncached(meme: MemeInfo):
+    assert meme.params_type.args_type
+    return [opt.option() for opt in meme.params_type.args_type.parser_options]
+
+
+def measure(name: str, func, memes: list[MemeInfo], repeat: int):
+    # 保留构建结果，模拟响应器与表情详情持有选项对象的情况
+    results = []
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for meme in memes:
+            results.append(func(meme))
+    duration = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<10} {duration * 1000:>10.2f} ms {peak / 1024:>10.1f} KiB peak")
+
+
+def main():
+    meme_num = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    memes = [make_meme(i) for i in range(meme_num)]
+    print(f"{meme_num} memes, {repeat} rounds")
+    measure("uncached", uncached, memes, repeat)
+    measure("cached", get_meme_options, memes, repeat)
+
+
+if __name__ == "__main__":
+    main()
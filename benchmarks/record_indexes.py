@@ -0,0 +1,171 @@
+"""表情调用记录表索引的查询耗时对比
+
+用法：python benchmarks/record_indexes.py [记录数量] [重复次数]
+
+在临时 SQLite 数据库中生成模拟的调用记录，
+对每种 `SessionIdType` 分别在有索引和无索引时执行统计查询并计时
+"""
+
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import nonebot
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+nonebot.init(localstore_use_cwd=True)
+# 先加载插件，以便加载其依赖的 uninfo、orm 插件
+nonebot.require("nonebot_plugin_memes_api")
+
+from nonebot_plugin_uninfo import Scene, SceneType, Session, User
+from nonebot_plugin_uninfo.orm import BotModel, SceneModel, SessionModel, UserModel
+from sqlalchemy import Engine, create_engine, func, select, text
+
+from nonebot_plugin_memes_api.recorder import (
+    MemeGenerationRecord,
+    SessionIdType,
+    filter_statement,
+)
+
+BOT_ID = "10000"
+GROUP_NUM = 200
+USER_NUM = 5000
+SESSION_NUM = 20000
+MEME_NUM = 300
+DAYS = 365
+NOW = datetime(2025, 1, 1)
+
+
+def populate(engine: Engine, record_num: int):
+    tables = [
+        BotModel.__table__,
+        SceneModel.__table__,
+        UserModel.__table__,
+        SessionModel.__table__,
+        MemeGenerationRecord.__table__,
+    ]
+    MemeGenerationRecord.metadata.create_all(engine, tables=tables)  # type: ignore
+
+    rng = random.Random(0)
+    conn = engine.raw_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO nonebot_plugin_uninfo_botmodel (id, self_id, adapter, scope) "
+        "VALUES (1, ?, 'OneBot V11', 'QQClient')",
+        (BOT_ID,),
+    )
+    cursor.executemany(
+        "INSERT INTO nonebot_plugin_uninfo_scenemodel "
+        "(id, bot_persist_id, parent_scene_persist_id, scene_id, scene_type, "
+        "scene_data) VALUES (?, 1, NULL, ?, ?, '{}')",
+        [(i + 1, str(i), SceneType.GROUP.value) for i in range(GROUP_NUM)],
+    )
+    cursor.executemany(
+        "INSERT INTO nonebot_plugin_uninfo_usermodel "
+        "(id, bot_persist_id, user_id, user_data) VALUES (?, 1, ?, '{}')",
+        [(i + 1, str(i)) for i in range(USER_NUM)],
+    )
+    sessions = {
+        (rng.randrange(GROUP_NUM) + 1, rng.randrange(USER_NUM) + 1)
+        for _ in range(SESSION_NUM)
+    }
+    cursor.executemany(
+        "INSERT INTO nonebot_plugin_uninfo_sessionmodel "
+        "(id, bot_persist_id, scene_persist_id, user_persist_id, member_data) "
+        "VALUES (?, 1, ?, ?, NULL)",
+        [(i + 1, scene, user) for i, (scene, user) in enumerate(sessions)],
+    )
+    start = NOW - timedelta(days=DAYS)
+    seconds = DAYS * 24 * 3600
+    batch_size = 100000
+    for offset in range(0, record_num, batch_size):
+        cursor.executemany(
+            "INSERT INTO nonebot_plugin_memes_api_memegenerationrecord_v2 "
+            "(session_persist_id, time, meme_key) VALUES (?, ?, ?)",
+            [
+                (
+                    rng.randrange(len(sessions)) + 1,
+                    str(start + timedelta(seconds=rng.randrange(seconds))),
+                    f"meme_{int(rng.paretovariate(1.2)) % MEME_NUM}",
+                )
+                for _ in range(min(batch_size, record_num - offset))
+            ],
+        )
+    conn.commit()
+    conn.close()
+    return list(sessions)
+
+
+def make_session(group: int, user: int) -> Session:
+    return Session(
+        self_id=BOT_ID,
+        adapter="OneBot V11",
+        scope="QQClient",
+        scene=Scene(id=str(group - 1), type=SceneType.GROUP),
+        user=User(id=str(user - 1)),
+    )
+
+
+def query(engine: Engine, session: Session, id_type: SessionIdType) -> float:
+    # 与统计命令相同：最近一周内某个表情的调用次数
+    whereclause = filter_statement(
+        session, id_type, meme_key="meme_1", time_start=NOW - timedelta(days=7)
+    )
+    statement = (
+        select(func.count())
+        .select_from(MemeGenerationRecord)
+        .where(*whereclause)
+        .join(SessionModel, SessionModel.id == MemeGenerationRecord.session_persist_id)
+        .join(BotModel, BotModel.id == SessionModel.bot_persist_id)
+        .join(SceneModel, SceneModel.id == SessionModel.scene_persist_id)
+        .join(UserModel, UserModel.id == SessionModel.user_persist_id)
+    )
+    start = time.perf_counter()
+    with engine.connect() as conn:
+        conn.execute(statement).scalar()
+    return time.perf_counter() - start
+
+
+def measure(engine: Engine, sessions: list[Session], repeat: int) -> dict:
+    result = {}
+    for id_type in SessionIdType:
+        durations = [query(engine, session, id_type) for session in sessions[:repeat]]
+        result[id_type] = sum(durations) / len(durations)
+    return result
+
+
+def main():
+    record_num = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine = create_engine(f"sqlite:///{Path(tmp_dir) / 'bench.db'}")
+        print(f"populating {record_num} records ...")
+        sessions = [make_session(*s) for s in populate(engine, record_num)]
+        rng = random.Random(1)
+        rng.shuffle(sessions)
+
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+        indexed = measure(engine, sessions, repeat)
+
+        with engine.begin() as conn:
+            for index in MemeGenerationRecord.__table__.indexes:  # type: ignore
+                conn.execute(text(f"DROP INDEX {index.name}"))
+            conn.execute(text("ANALYZE"))
+        plain = measure(engine, sessions, repeat)
+
+        print(f"{'id type':<12} {'no index':>12} {'indexed':>12} {'speedup':>8}")
+        for id_type in SessionIdType:
+            print(
+                f"{id_type.name:<12} {plain[id_type] * 1000:>9.2f} ms "
+                f"{indexed[id_type] * 1000:>9.2f} ms "
+                f"{plain[id_type] / indexed[id_type]:>7.1f}x"
+            )
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
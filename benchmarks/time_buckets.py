@@ -0,0 +1,75 @@
+"""表情调用统计时间分段的耗时对比
+
+用法：python benchmarks/time_buckets.py [记录数量]
+
+对每种统计类型生成随机的调用时间，对比原先逐条遍历的分段方式
+与基于 `datetime64` 数组的分段方式的耗时（不含转换为数组的时间），并检查两者结果一致
+"""
+
+import random
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from time import perf_counter
+
+import nonebot
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+nonebot.init(localstore_use_cwd=True)
+
+from nonebot_plugin_memes_api.bucket import bucket_indices, get_time_buckets
+from nonebot_plugin_memes_api.utils import add_timezone, remove_timezone
+from tests.legacy_buckets import TYPES, loop_counts
+
+
+def datetime_array(times: list[datetime]) -> np.ndarray:
+    """转换为 UTC 时间的 `datetime64` 数组，不带时区的时间视为 UTC 时间"""
+    return np.array([remove_timezone(time) for time in times], dtype="datetime64[us]")
+
+
+def bucket_counts(values: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """统计各区间内的值的个数"""
+    indices = bucket_indices(values, edges)
+    return np.bincount(indices[indices >= 0], minlength=len(edges) - 1)
+
+
+def array_counts(type: str, now: datetime, times: np.ndarray) -> dict[str, int]:
+    buckets = get_time_buckets(type, now)  # type: ignore
+    counts = bucket_counts(times, datetime_array(buckets.edges))
+    return dict(zip(buckets.labels, counts.tolist()))
+
+
+def main():
+    record_num = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    rng = random.Random(0)
+    now = datetime.now().astimezone()
+    print(f"{record_num} records")
+    print(f"{'type':<6} {'loop':>12} {'array':>12}")
+    for type in TYPES:
+        start = get_time_buckets(type, now).edges[0]  # type: ignore
+        # 与数据库中的记录相同，存放不带时区的 UTC 时间
+        times = [
+            remove_timezone(start.astimezone(timezone.utc))
+            + (now - start) * rng.random()
+            for _ in range(record_num)
+        ]
+        time_array = datetime_array(times)
+
+        begin = perf_counter()
+        expected = loop_counts(type, now, [add_timezone(time) for time in times])
+        loop_duration = perf_counter() - begin
+
+        begin = perf_counter()
+        result = array_counts(type, now, time_array)
+        array_duration = perf_counter() - begin
+
+        assert result == expected, (type, result, expected)
+        print(
+            f"{type:<6} {loop_duration * 1000:>9.2f} ms "
+            f"{array_duration * 1000:>9.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Literal, Union
+
+import numpy as np
+from dateutil.relativedelta import relativedelta
+
+StatisticsType = Literal["day", "week", "month", "year", "24h", "7d", "30d", "1y"]
+
+
+@dataclass
+class TimeBuckets:
+    edges: list[datetime]
+    """ 区间端点，第 i 个区间为 `[edges[i], edges[i + 1])` """
+    labels: list[str]
+    """ 各区间的显示名称 """
+    humanized: str
+    """ 统计时段的显示名称 """
+
+
+def get_time_buckets(type: StatisticsType, now: datetime) -> TimeBuckets:
+    """表情调用统计各统计类型的时间区间
+
+    区间从统计开始时间起依次划分，直到包含当前时间为止；
+    最近一段时间的统计以区间结束时间作为名称，其余以区间开始时间作为名称
+    """
+    td: Union[timedelta, relativedelta]
+    if type == "24h":
+        start = now - timedelta(days=1)
+        td = timedelta(hours=1)
+        fmt = "%H:%M"
+        humanized = "24小时"
+    elif type == "day":
+        start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        td = timedelta(hours=1)
+        fmt = "%H:%M"
+        humanized = "本日"
+    elif type == "7d":
+        start = now - timedelta(days=7)
+        td = timedelta(days=1)
+        fmt = "%m/%d"
+        humanized = "7天"
+    elif type == "week":
+        start = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(
+            days=now.weekday()
+        )
+        td = timedelta(days=1)
+        fmt = "%a"
+        humanized = "本周"
+    elif type == "30d":
+        start = now - timedelta(days=30)
+        td = timedelta(days=1)
+        fmt = "%m/%d"
+        humanized = "30天"
+    elif type == "month":
+        start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        td = timedelta(days=1)
+        fmt = "%m/%d"
+        humanized = "本月"
+    elif type == "1y":
+        start = now - relativedelta(years=1)
+        td = relativedelta(months=1)
+        fmt = "%y/%m"
+        humanized = "一年"
+    else:
+        start = now.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+        td = relativedelta(months=1)
+        fmt = "%b"
+        humanized = "本年"
+
+    edges = [start]
+    while edges[-1] <= now:
+        edges.append(edges[-1] + td)
+
+    if type in ["24h", "7d", "30d", "1y"]:
+        labels = [edge.strftime(fmt) for edge in edges[1:]]
+    else:
+        labels = [edge.strftime(fmt) for edge in edges[:-1]]
+    return TimeBuckets(edges=edges, labels=labels, humanized=humanized)
+
+
+def bucket_indices(values: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """计算各值所在区间 `[edges[i], edges[i + 1])` 的序号，不在任何区间内时为 -1
+
+    `edges` 须为递增数组，`values` 无需有序
+    """
+    indices = np.searchsorted(edges, values, side="right") - 1
+    indices[indices >= len(edges) - 1] = -1
+    return indices
@@ -0,0 +1,420 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable
+from datetime import timedelta
+from pathlib import Path
+from typing import Any, Callable, Generic, Optional, TypeVar
+
+from nonebot import get_driver
+from nonebot.log import logger
+from nonebot.utils import run_sync
+from nonebot_plugin_localstore import get_cache_dir
+
+from .config import memes_config
+from .request import MemeInfo, generate_meme_preview
+
+memes_cache_dir = get_cache_dir("nonebot_plugin_memes_api")
+
+T = TypeVar("T")
+
+
+class MemoryCache:
+    """内存 LRU 缓存，按总字节数淘汰"""
+
+    def __init__(self, max_size: int, ttl: Optional[timedelta] = None):
+        self.max_size = max_size
+        self.ttl = ttl.total_seconds() if ttl else None
+        self.size = 0
+        self.__data: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        if (item := self.__data.get(key)) is None:
+            return None
+        created, value = item
+        if self.ttl is not None and time.time() - created > self.ttl:
+            self.pop(key)
+            return None
+        self.__data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: bytes):
+        if len(value) > self.max_size:
+            return
+        self.pop(key)
+        self.__data[key] = (time.time(), value)
+        self.size += len(value)
+        while self.size > self.max_size:
+            _, (_, old_value) = self.__data.popitem(last=False)
+            self.size -= len(old_value)
+
+    def pop(self, key: str):
+        if (item := self.__data.pop(key, None)) is not None:
+            self.size -= len(item[1])
+
+
+class TTLCache(Generic[T]):
+    """内存 LRU 缓存，按条目数淘汰"""
+
+    def __init__(self, max_items: int, ttl: Optional[timedelta] = None):
+        self.max_items = max_items
+        self.ttl = ttl.total_seconds() if ttl else None
+        self.hits = 0
+        self.misses = 0
+        self.__data: OrderedDict[Any, tuple[float, T]] = OrderedDict()
+
+    def get(self, key: Any) -> Optional[T]:
+        if (item := self.__data.get(key)) is None:
+            self.misses += 1
+            return None
+        created, value = item
+        if self.ttl is not None and time.time() - created > self.ttl:
+            del self.__data[key]
+            self.misses += 1
+            return None
+        self.__data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Any, value: T):
+        if self.max_items <= 0:
+            return
+        self.__data[key] = (time.time(), value)
+        self.__data.move_to_end(key)
+        while len(self.__data) > self.max_items:
+            self.__data.popitem(last=False)
+
+    def pop(self, key: Any):
+        self.__data.pop(key, None)
+
+    def clear(self):
+        self.__data.clear()
+
+
+class DiskCache:
+    """磁盘缓存，按总字节数淘汰最久未访问的文件
+
+    文件索引在关闭时保存至缓存目录下的索引文件，下次启动时读取，无需扫描目录；
+    读取后即删除索引文件，未正常退出时下次启动会重新扫描目录
+    """
+
+    INDEX_FILE = "index.json"
+
+    def __init__(self, path: Path, max_size: int, ttl: Optional[timedelta] = None):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl.total_seconds() if ttl else None
+        self.size = 0
+        self.__index: Optional[OrderedDict[str, tuple[float, int]]] = None
+        self.__last_expire = time.time()
+        self.__lock = threading.RLock()
+
+    @property
+    def index(self) -> OrderedDict[str, tuple[float, int]]:
+        """文件名 -> (修改时间, 文件大小)，按访问顺序排列；首次使用时读取索引文件"""
+        if self.__index is None:
+            self.path.mkdir(parents=True, exist_ok=True)
+            if (index := self.__load_index()) is None:
+                index = self.__scan()
+            self.__index = index
+            self.size = sum(size for _, size in index.values())
+            self.expire()
+        return self.__index
+
+    def __load_index(self) -> Optional[OrderedDict[str, tuple[float, int]]]:
+        index_file = self.path / self.INDEX_FILE
+        if not index_file.exists():
+            return None
+        try:
+            data = json.loads(index_file.read_text(encoding="utf-8"))
+            index_file.unlink()
+            return OrderedDict(
+                (name, (mtime, size)) for name, mtime, size in data["files"]
+            )
+        except Exception as e:
+            logger.warning(f"缓存索引 {index_file} 读取失败：{e}")
+            return None
+
+    def __scan(self) -> OrderedDict[str, tuple[float, int]]:
+        files = []
+        for file in self.path.iterdir():
+            if (
+                file.is_file()
+                and file.name != self.INDEX_FILE
+                and not file.name.endswith(".tmp")
+            ):
+                stat = file.stat()
+                files.append((stat.st_atime, file.name, stat.st_mtime, stat.st_size))
+        files.sort()
+        return OrderedDict((name, (mtime, size)) for _, name, mtime, size in files)
+
+    def save_index(self):
+        """保存文件索引；未使用过的缓存保留原有的索引文件"""
+        with self.__lock:
+            if self.__index is None:
+                return
+            data = {
+                "files": [
+                    [name, mtime, size] for name, (mtime, size) in self.__index.items()
+                ]
+            }
+            index_file = self.path / self.INDEX_FILE
+            tmp_file = self.path / f"{self.INDEX_FILE}.tmp"
+            try:
+                tmp_file.write_text(json.dumps(data), encoding="utf-8")
+                os.replace(tmp_file, index_file)
+            except OSError as e:
+                logger.warning(f"缓存索引 {index_file} 保存失败：{e}")
+
+    def expire(self):
+        """删除超过有效期的文件"""
+        if self.ttl is None:
+            return
+        with self.__lock:
+            now = time.time()
+            self.__last_expire = now
+            for key, (mtime, _) in list(self.index.items()):
+                if now - mtime > self.ttl:
+                    self.pop(key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self.__lock:
+            if (item := self.index.get(key)) is None:
+                return None
+            if self.ttl is not None and time.time() - item[0] > self.ttl:
+                self.pop(key)
+                return None
+            try:
+                value = (self.path / key).read_bytes()
+            except OSError:
+                self.pop(key)
+                return None
+            self.index.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes):
+        if len(value) > self.max_size:
+            return
+        with self.__lock:
+            self.pop(key)
+            file = self.path / key
+            tmp_file = self.path / f"{key}.tmp"
+            try:
+                tmp_file.write_bytes(value)
+                os.replace(tmp_file, file)
+            except OSError as e:
+                logger.warning(f"缓存文件 {file} 写入失败：{e}")
+                return
+            self.index[key] = (time.time(), len(value))
+            self.size += len(value)
+            while self.size > self.max_size:
+                self.pop(next(iter(self.index)))
+            # 按访问顺序淘汰不会删除仍被访问的过期文件，定期清理一次
+            if self.ttl is not None and time.time() - self.__last_expire > 600:
+                self.expire()
+
+    def pop(self, key: str):
+        with self.__lock:
+            if (item := self.index.pop(key, None)) is None:
+                return
+            self.size -= item[1]
+            (self.path / key).unlink(missing_ok=True)
+
+
+class ResultCache:
+    """表情生成结果缓存，分为内存和磁盘两级"""
+
+    def __init__(
+        self, path: Path, memory_size: int, disk_size: int, ttl: Optional[timedelta]
+    ):
+        self.memory = MemoryCache(memory_size, ttl)
+        self.disk = DiskCache(path, disk_size, ttl)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(
+        meme_key: str, images: list[bytes], texts: list[str], args: dict[str, Any]
+    ) -> str:
+        hasher = hashlib.sha256()
+        hasher.update(meme_key.encode("utf8"))
+        for image in images:
+            hasher.update(hashlib.sha256(image).digest())
+        hasher.update(json.dumps(texts, ensure_ascii=False).encode("utf8"))
+        hasher.update(
+            json.dumps(args, ensure_ascii=False, sort_keys=True).encode("utf8")
+        )
+        return hasher.hexdigest()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        if (value := self.memory.get(key)) is None:
+            if (value := await run_sync(self.disk.get)(key)) is not None:
+                self.memory.set(key, value)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: bytes):
+        self.memory.set(key, value)
+        await run_sync(self.disk.set)(key, value)
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_size": self.memory.size,
+            "disk_size": self.disk.size,
+        }
+
+
+class FetchCache:
+    """下载内容缓存，同时合并对同一资源的并发请求"""
+
+    def __init__(self, max_size: int, ttl: Optional[timedelta] = None):
+        self.memory = MemoryCache(max_size, ttl)
+        self.__tasks: dict[str, asyncio.Task[bytes]] = {}
+
+    async def get_or_fetch(
+        self, key: str, fetch: Callable[[], Awaitable[bytes]]
+    ) -> bytes:
+        if (value := self.memory.get(key)) is not None:
+            return value
+        if (task := self.__tasks.get(key)) is None:
+
+            async def run() -> bytes:
+                try:
+                    value = await fetch()
+                    self.memory.set(key, value)
+                    return value
+                finally:
+                    self.__tasks.pop(key, None)
+
+            task = asyncio.create_task(run())
+            self.__tasks[key] = task
+        return await asyncio.shield(task)
+
+
+class RenderCache:
+    """渲染结果磁盘缓存，同时合并对同一内容的并发渲染"""
+
+    def __init__(self, path: Path, max_size: int, ttl: Optional[timedelta] = None):
+        self.disk = DiskCache(path, max_size, ttl)
+        self.__tasks: dict[str, asyncio.Task[bytes]] = {}
+
+    async def get_or_render(
+        self, key: str, render: Callable[[], Awaitable[bytes]]
+    ) -> bytes:
+        if (task := self.__tasks.get(key)) is None:
+
+            async def run() -> bytes:
+                try:
+                    if (value := await run_sync(self.disk.get)(key)) is None:
+                        value = await render()
+                        await run_sync(self.disk.set)(key, value)
+                    return value
+                finally:
+                    self.__tasks.pop(key, None)
+
+            task = asyncio.create_task(run())
+            self.__tasks[key] = task
+        return await asyncio.shield(task)
+
+
+class PreviewCache:
+    """表情预览缓存，按表情名和修改时间存放"""
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def file(self, meme: MemeInfo) -> Path:
+        return self.path / meme.key / str(int(meme.date_modified.timestamp()))
+
+    def get(self, meme: MemeInfo) -> Optional[bytes]:
+        try:
+            return self.file(meme).read_bytes()
+        except OSError:
+            return None
+
+    def set(self, meme: MemeInfo, value: bytes):
+        file = self.file(meme)
+        tmp_file = file.with_suffix(".tmp")
+        try:
+            file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file.write_bytes(value)
+            os.replace(tmp_file, file)
+        except OSError as e:
+            logger.warning(f"缓存文件 {file} 写入失败：{e}")
+
+    def remove(self, meme_key: str):
+        shutil.rmtree(self.path / meme_key, ignore_errors=True)
+
+
+MB = 1024 * 1024
+
+result_cache = ResultCache(
+    memes_cache_dir / "results",
+    memory_size=memes_config.memes_result_cache_memory_size * MB,
+    disk_size=memes_config.memes_result_cache_disk_size * MB,
+    ttl=memes_config.memes_result_cache_ttl,
+)
+image_cache = FetchCache(
+    max_size=memes_config.memes_image_cache_size * MB,
+    ttl=memes_config.memes_image_cache_ttl,
+)
+
+preview_cache = PreviewCache(memes_cache_dir / "previews")
+list_image_cache = RenderCache(
+    memes_cache_dir / "list_images",
+    max_size=memes_config.memes_list_image_config.cache_size * MB,
+    ttl=memes_config.memes_list_image_config.cache_ttl,
+)
+
+driver = get_driver()
+
+
+@driver.on_startup
+async def _():
+    def remove_legacy_list_images():
+        # 旧版本直接存放在缓存目录下、不会被淘汰的表情列表图
+        for file in memes_cache_dir.glob("*.jpg"):
+            file.unlink(missing_ok=True)
+
+    await run_sync(remove_legacy_list_images)()
+
+
+@driver.on_shutdown
+async def _():
+    if result_cache.hits or result_cache.misses:
+        logger.info(f"生成结果缓存统计：{result_cache.stats}")
+    await run_sync(result_cache.disk.save_index)()
+    await run_sync(list_image_cache.disk.save_index)()
+
+
+async def get_meme_preview(meme: MemeInfo) -> bytes:
+    if (preview := await run_sync(preview_cache.get)(meme)) is None:
+        preview = await generate_meme_preview(meme.key)
+        await run_sync(preview_cache.set)(meme, preview)
+    return preview
+
+
+async def prewarm_meme_previews(memes: list[MemeInfo]):
+    """预先生成表情预览"""
+    semaphore = asyncio.Semaphore(4)
+
+    async def prewarm(meme: MemeInfo):
+        async with semaphore:
+            try:
+                await get_meme_preview(meme)
+            except Exception as e:
+                logger.warning(f"表情 {meme.key} 预览生成失败：{e}")
+
+    await asyncio.gather(*[prewarm(meme) for meme in memes])
+    logger.info(f"已预先生成 {len(memes)} 个表情的预览")
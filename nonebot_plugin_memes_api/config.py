@@ -13,18 +13,49 @@ class MemeListImageConfig(BaseModel):
     label_new_timedelta: timedelta = timedelta(days=30)
     label_hot_threshold: int = 21
     label_hot_days: int = 7
+    label_hot_cache_ttl: timedelta = timedelta(minutes=5)
+    cache_size: int = 64
+    cache_ttl: Optional[timedelta] = timedelta(days=7)
 
 
 class Config(BaseModel):
     meme_generator_base_url: str = "http://127.0.0.1:2233"
+    meme_generator_uds: Optional[str] = None
+    memes_http_timeout: float = 300
+    memes_http_max_connections: int = 100
+    memes_http_max_keepalive_connections: int = 20
+    memes_http_keepalive_expiry: float = 30
+    memes_http2: bool = False
+    memes_fetch_info_concurrency: int = 16
     memes_command_prefixes: Optional[list[str]] = None
     memes_disabled_list: list[str] = []
+    memes_manager_config_format: Literal["yaml", "jsonl"] = "yaml"
+    memes_manager_save_delay: float = 5
+    memes_dispatch_mode: bool = False
     memes_check_resources_on_startup: bool = True
     memes_prompt_params_error: bool = False
     memes_use_sender_when_no_image: bool = False
     memes_use_default_when_no_text: bool = False
     memes_random_meme_show_info: bool = True
+    memes_random_meme_weight_hours: int = 0
     memes_list_image_config: MemeListImageConfig = MemeListImageConfig()
+    memes_result_cache_enabled: bool = False
+    memes_result_cache_ttl: Optional[timedelta] = timedelta(days=1)
+    memes_result_cache_memory_size: int = 64
+    memes_result_cache_disk_size: int = 512
+    memes_preview_prewarm_count: int = 0
+    memes_image_cache_ttl: Optional[timedelta] = timedelta(minutes=10)
+    memes_image_cache_size: int = 64
+    memes_user_cache_ttl: Optional[timedelta] = timedelta(minutes=10)
+    memes_record_batch_size: int = 100
+    memes_record_flush_interval: float = 5
+    memes_record_queue_size: int = 10000
+    memes_record_retention_days: Optional[int] = None
+    memes_record_prune_interval: float = 3600
+    memes_usage_counter_hours: int = 168
+    memes_usage_counter_save_interval: float = 600
+    memes_plot_workers: int = 1
+    memes_plot_process: bool = False
 
 
 memes_config = get_plugin_config(Config)
@@ -0,0 +1,226 @@
+import asyncio
+import json
+import os
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+from nonebot import get_driver
+from nonebot.log import logger
+from nonebot.utils import run_sync
+from nonebot_plugin_localstore import get_data_file
+
+from .bucket import bucket_indices
+from .config import memes_config
+from .utils import remove_timezone
+
+EPOCH = datetime(1970, 1, 1)
+HOUR = timedelta(hours=1)
+# 计数文件格式版本，格式不一致时丢弃文件中的计数
+FILE_VERSION = 2
+
+ScopeKey = tuple[str, ...]
+
+
+def hour_index(dt: datetime) -> int:
+    """UTC 时间所在小时的序号"""
+    return (remove_timezone(dt) - EPOCH) // HOUR
+
+
+class UsageCounter:
+    """按小时滚动的表情调用次数计数器
+
+    按小时存放当前小时及之前 `hours` 个小时内各统计范围、各表情的非零调用次数；
+    查询时不在整点的区间端点向后取整到整点，区间须完全处于已记录时段内，否则需查询数据库
+    """
+
+    def __init__(self, hours: int, path: Path):
+        self.hours = hours
+        # 除之前的 `hours` 个整小时外，还需存放当前小时
+        self.slots = hours + 1
+        self.path = path
+        self.current_hour = hour_index(datetime.now(timezone.utc))
+        # 从该小时起的计数是完整的；当前小时在启动前的调用未被计入
+        self.reliable_since = self.current_hour + 1
+        self.dirty = False
+        self.__hours: dict[int, dict[ScopeKey, Counter[str]]] = {}
+        # 与最近一次快照共用的各小时计数，修改前需先复制
+        self.__shared_hours: set[int] = set()
+
+    def __advance(self, hour: int):
+        if hour <= self.current_hour:
+            return
+        # 只需移除滑出时段的小时，不必遍历各统计范围
+        if hour - self.current_hour >= self.slots:
+            self.__hours.clear()
+        else:
+            for expired in range(
+                self.current_hour - self.slots + 1, hour - self.slots + 1
+            ):
+                self.__hours.pop(expired, None)
+        self.current_hour = hour
+
+    def add(self, scope_keys: list[ScopeKey], meme_key: str, time: datetime):
+        if self.hours <= 0:
+            return
+        hour = hour_index(time)
+        self.__advance(hour)
+        if hour <= self.current_hour - self.slots:
+            return
+        if (scope_counts := self.__hours.get(hour)) is None:
+            scope_counts = self.__hours[hour] = {}
+        elif hour in self.__shared_hours:
+            # 快照可能正在其他线程中保存，复制后再修改
+            self.__shared_hours.discard(hour)
+            scope_counts = self.__hours[hour] = {
+                key: counts.copy() for key, counts in scope_counts.items()
+            }
+        for scope_key in scope_keys:
+            scope_counts.setdefault(scope_key, Counter())[meme_key] += 1
+        self.dirty = True
+
+    def query(
+        self,
+        scope_key: ScopeKey,
+        edges: list[datetime],
+        *,
+        meme_key: Optional[str] = None,
+    ) -> Optional[Counter[tuple[int, str]]]:
+        """统计每个时间区间 `[edges[i], edges[i + 1])` 内各表情的调用次数
+
+        不在整点的端点向后取整，即以端点所在小时的结束时间代替，
+        如 24 小时统计中的每个区间近似为该区间结束时间所在的整小时；
+        无法由计数器得出结果时返回 `None`
+        """
+        if self.hours <= 0 or len(edges) < 2:
+            return None
+        now = datetime.now(timezone.utc)
+        self.__advance(hour_index(now))
+        hour_edges: list[int] = []
+        for edge in edges:
+            hour = hour_index(edge)
+            if remove_timezone(edge) != EPOCH + hour * HOUR:
+                hour += 1
+            if edge >= now:
+                # 晚于当前时间的端点只需覆盖当前小时
+                hour = max(hour, self.current_hour + 1)
+            hour_edges.append(hour)
+        if (
+            hour_edges[0] < self.reliable_since
+            or hour_edges[0] <= self.current_hour - self.slots
+        ):
+            return None
+
+        result: Counter[tuple[int, str]] = Counter()
+        hours = [
+            hour
+            for hour in range(hour_edges[0], min(hour_edges[-1], self.current_hour + 1))
+            if scope_key in self.__hours.get(hour, {})
+        ]
+        if not hours:
+            return result
+        indices = bucket_indices(np.array(hours), np.array(hour_edges))
+        for hour, bucket in zip(hours, indices.tolist()):
+            counts = self.__hours[hour][scope_key]
+            if meme_key is not None:
+                if count := counts.get(meme_key):
+                    result[(bucket, meme_key)] += count
+                continue
+            for key, count in counts.items():
+                result[(bucket, key)] += count
+        return result
+
+    def dump(self, clean: bool) -> dict[str, Any]:
+        """获取当前计数的快照，由 `save_file` 在其他线程中序列化
+
+        快照与计数器共用之前小时的计数，之后修改这些小时时再复制，
+        因此只需复制当前小时的计数
+        """
+        self.dirty = False
+        hours = self.__hours.copy()
+        if (scope_counts := hours.get(self.current_hour)) is not None:
+            hours[self.current_hour] = {
+                key: counts.copy() for key, counts in scope_counts.items()
+            }
+        self.__shared_hours = set(hours) - {self.current_hour}
+        return {
+            "version": FILE_VERSION,
+            "hours": self.hours,
+            "slots": self.slots,
+            "current_hour": self.current_hour,
+            "reliable_since": self.reliable_since,
+            "clean": clean,
+            "counts": hours,
+        }
+
+    def load(self, data: dict[str, Any]):
+        if data.get("version") != FILE_VERSION or data.get("slots") != self.slots:
+            return
+        for hour, scope_key, counts in data["counts"]:
+            self.__hours.setdefault(hour, {})[tuple(scope_key)] = Counter(counts)
+        now_hour = self.current_hour
+        self.current_hour = data["current_hour"]
+        # 上次未正常退出时，最后一次保存之后的调用未被计入
+        if data["clean"]:
+            self.reliable_since = data["reliable_since"]
+        self.__advance(now_hour)
+
+    def save_file(self, data: dict[str, Any]):
+        counts: dict[int, dict[ScopeKey, Counter[str]]] = data["counts"]
+        data = {
+            **data,
+            "counts": [
+                [hour, list(scope_key), meme_counts]
+                for hour, scope_counts in counts.items()
+                for scope_key, meme_counts in scope_counts.items()
+            ],
+        }
+        tmp_file = self.path.with_suffix(".tmp")
+        try:
+            tmp_file.write_text(json.dumps(data), encoding="utf-8")
+            os.replace(tmp_file, self.path)
+        except OSError as e:
+            logger.warning(f"表情调用计数保存失败：{e}")
+
+    def load_file(self):
+        if not self.path.exists():
+            return
+        try:
+            self.load(json.loads(self.path.read_text(encoding="utf-8")))
+        except Exception as e:
+            logger.warning(f"表情调用计数读取失败：{e}")
+
+
+usage_counter = UsageCounter(
+    hours=memes_config.memes_usage_counter_hours,
+    path=get_data_file("nonebot_plugin_memes_api", "usage_counter.json"),
+)
+
+driver = get_driver()
+save_task: Optional[asyncio.Task] = None
+
+
+async def save_periodically():
+    while True:
+        await asyncio.sleep(memes_config.memes_usage_counter_save_interval)
+        if usage_counter.dirty:
+            await run_sync(usage_counter.save_file)(usage_counter.dump(clean=False))
+
+
+@driver.on_startup
+async def _():
+    global save_task
+    if usage_counter.hours <= 0:
+        return
+    await run_sync(usage_counter.load_file)()
+    save_task = asyncio.create_task(save_periodically())
+
+
+@driver.on_shutdown
+async def _():
+    if save_task is None:
+        return
+    save_task.cancel()
+    await run_sync(usage_counter.save_file)(usage_counter.dump(clean=True))
@@ -0,0 +1,98 @@
+import csv
+import gzip
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import IO, Optional
+
+from nonebot.utils import run_sync
+from nonebot_plugin_localstore import get_data_dir
+
+from .recorder import MemeExportRecord, iter_meme_generation_export_records
+
+memes_export_dir = get_data_dir("nonebot_plugin_memes_api") / "exports"
+
+EXPORT_FIELDS = [
+    "id",
+    "time",
+    "meme_key",
+    "adapter",
+    "scope",
+    "self_id",
+    "scene_type",
+    "scene_id",
+    "user_id",
+]
+
+
+class ChunkedCsvWriter:
+    """将记录写入多个 gzip 压缩的 csv 文件，每个文件最多 `chunk_size` 行"""
+
+    def __init__(self, directory: Path, prefix: str, chunk_size: int):
+        self.directory = directory
+        self.prefix = prefix
+        self.chunk_size = chunk_size
+        self.files: list[Path] = []
+        self.rows = 0
+        self.__file: Optional[IO[str]] = None
+        self.__writer = None
+        self.__chunk_rows = 0
+
+    def __open(self):
+        self.close()
+        file = self.directory / f"{self.prefix}_{len(self.files):04d}.csv.gz"
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.__file = gzip.open(file, "wt", encoding="utf-8", newline="")
+        self.__writer = csv.writer(self.__file)
+        self.__writer.writerow(EXPORT_FIELDS)
+        self.__chunk_rows = 0
+        self.files.append(file)
+
+    def write(self, records: list[MemeExportRecord]):
+        for record in records:
+            if self.__writer is None or self.__chunk_rows >= self.chunk_size:
+                self.__open()
+            assert self.__writer
+            self.__writer.writerow(
+                [
+                    record.id,
+                    record.time.replace(tzinfo=timezone.utc).isoformat(),
+                    record.meme_key,
+                    record.adapter,
+                    record.scope,
+                    record.self_id,
+                    record.scene_type,
+                    record.scene_id,
+                    record.user_id,
+                ]
+            )
+            self.__chunk_rows += 1
+            self.rows += 1
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+            self.__writer = None
+
+
+async def export_meme_generation_records(
+    *,
+    time_start: Optional[datetime] = None,
+    time_stop: Optional[datetime] = None,
+    directory: Path = memes_export_dir,
+    chunk_size: int = 1_000_000,
+) -> tuple[int, list[Path]]:
+    """导出调用记录为 gzip 压缩的 csv 文件
+
+    记录分批读取、逐批写入，不会一次性载入内存；返回导出的记录数和文件列表
+    """
+    prefix = "memes_records_" + datetime.now().strftime("%Y%m%d%H%M%S")
+    writer = ChunkedCsvWriter(directory, prefix, chunk_size)
+    try:
+        async for records in iter_meme_generation_export_records(
+            time_start=time_start, time_stop=time_stop, batch_size=10000
+        ):
+            await run_sync(writer.write)(records)
+    finally:
+        await run_sync(writer.close)()
+    return writer.rows, writer.files
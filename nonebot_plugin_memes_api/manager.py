@@ -1,18 +1,38 @@
-from enum import IntEnum
+import asyncio
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from enum import Enum, IntEnum
+from itertools import chain
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Literal, Optional
 
+import numpy as np
 import yaml
+from nonebot import get_driver
 from nonebot.compat import PYDANTIC_V2, model_dump, type_validate_python
 from nonebot.log import logger
-from nonebot_plugin_localstore import get_config_file
+from nonebot.utils import run_sync
+from nonebot_plugin_localstore import get_cache_file, get_config_file
 from pydantic import BaseModel
+from pypinyin import Style, pinyin
 from rapidfuzz import process
 
+from .cache import TTLCache, preview_cache
 from .config import memes_config
-from .request import MemeInfo, get_meme_info, get_meme_keys
+from .request import (
+    MemeInfo,
+    get_meme_info,
+    get_meme_infos,
+    get_meme_keys,
+    get_version,
+)
 
 config_path = get_config_file("nonebot_plugin_memes_api", "meme_manager.yml")
+snapshot_path = get_cache_file("nonebot_plugin_memes_api", "meme_infos.json")
 
 
 class MemeMode(IntEnum):
@@ -37,26 +57,129 @@ class MemeConfig(BaseModel):
             use_enum_values = True
 
 
+@dataclass
+class MemeChanges:
+    added: list[MemeInfo] = field(default_factory=list)
+    removed: list[MemeInfo] = field(default_factory=list)
+    modified: list[MemeInfo] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.modified)
+
+
+class MemeSnapshot(BaseModel):
+    version: Optional[str] = None
+    memes: list[MemeInfo] = []
+
+
+def _json_default(obj: Any) -> Any:
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if isinstance(obj, set):
+        return sorted(obj)
+    if isinstance(obj, Enum):
+        return obj.value
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+SortBy = Literal["key", "keywords", "date_created", "date_modified"]
+
+
 class MemeManager:
-    def __init__(self, path: Path = config_path):
+    def __init__(self, path: Path = config_path, snapshot_path: Path = snapshot_path):
         self.__path = path
+        self.__jsonl_path = path.with_suffix(".jsonl")
+        self.__format = memes_config.memes_manager_config_format
+        # 表情列表配置的保存：待写入的表情、是否需要完整写入、JSON Lines 文件的行数
+        self.__dirty_keys: set[str] = set()
+        self.__full_save = False
+        self.__jsonl_lines = 0
+        self.__save_task: Optional[asyncio.Task] = None
+        self.__save_lock: Optional[asyncio.Lock] = None
+        self.__snapshot_path = snapshot_path
+        self.__snapshot_version: Optional[str] = None
         self.__meme_config: dict[str, MemeConfig] = {}
         self.__meme_dict: dict[str, MemeInfo] = {}
         self.__meme_names: dict[str, list[MemeInfo]] = {}
         self.__meme_tags: dict[str, list[MemeInfo]] = {}
+        self.__catalogue_stamp = ""
+        self.__pinyin_keys: dict[str, str] = {}
+        self.__sorted_indices: dict[tuple[SortBy, bool], np.ndarray] = {}
+        # 表情在 `get_memes` 中的序号
+        self.__meme_indices: dict[str, int] = {}
+        # 各表情对未在名单中的用户是否可用，即是否为黑名单模式
+        self.__default_mask = np.zeros(0, dtype=bool)
+        # 用户 -> 与默认情况相反的表情序号，即用户所在的当前模式名单
+        self.__exceptions: dict[str, set[int]] = {}
+        self.__user_masks: TTLCache[np.ndarray] = TTLCache(max_items=1024)
+        # 各表情的图片、文字数量范围：min_images, max_images, min_texts, max_texts
+        self.__params_ranges = np.zeros((0, 4), dtype=np.int64)
+        self.__eligible_masks: TTLCache[np.ndarray] = TTLCache(max_items=64)
+
+    @property
+    def catalogue_stamp(self) -> str:
+        """由表情名和修改时间计算出的摘要，重启后仍保持一致"""
+        return self.__catalogue_stamp
 
-    async def init(self):
-        self.__meme_dict = {
-            meme_key: await get_meme_info(meme_key)
-            for meme_key in filter(
-                lambda meme_key: meme_key not in memes_config.memes_disabled_list,
-                sorted(await get_meme_keys()),
+    def load_snapshot(self) -> bool:
+        """从本地快照加载表情信息，用于启动时快速创建响应器"""
+        if not self.__snapshot_path.exists():
+            return False
+        try:
+            snapshot = type_validate_python(
+                MemeSnapshot,
+                json.loads(self.__snapshot_path.read_text(encoding="utf-8")),
             )
-        }
+        except Exception:
+            logger.warning("表情信息快照解析失败，将重新获取")
+            return False
+        self.__snapshot_version = snapshot.version
+        self.__update(
+            {
+                meme.key: meme
+                for meme in sorted(snapshot.memes, key=lambda meme: meme.key)
+                if meme.key not in memes_config.memes_disabled_list
+            }
+        )
         self.__load()
-        self.__dump()
-        self.__refresh_names()
-        self.__refresh_tags()
+        logger.info(f"已从快照加载 {len(self.__meme_dict)} 个表情")
+        return True
+
+    async def init(self, force: bool = False) -> MemeChanges:
+        start = time.perf_counter()
+        version = await get_version()
+        meme_keys = [
+            meme_key
+            for meme_key in sorted(await get_meme_keys())
+            if meme_key not in memes_config.memes_disabled_list
+        ]
+        if (
+            not force
+            and version
+            and version == self.__snapshot_version
+            and meme_keys == list(self.__meme_dict.keys())
+        ):
+            logger.info(f"meme-generator 版本 {version} 未变化，使用表情信息快照")
+            changes = MemeChanges()
+        else:
+            changes = self.__update(await self.__fetch_meme_infos(meme_keys))
+            for meme in changes.removed + changes.modified:
+                preview_cache.remove(meme.key)
+            self.__snapshot_version = version
+            self.__dump_snapshot()
+        logger.info(
+            f"表情加载完成，共 {len(self.__meme_dict)} 个表情，"
+            f"新增 {len(changes.added)} 个，删除 {len(changes.removed)} 个，"
+            f"更新 {len(changes.modified)} 个，"
+            f"耗时 {time.perf_counter() - start:.2f}s"
+        )
+        # 重新读取配置前先写入尚未保存的修改，写入期间的修改也需写入后再读取
+        async with self.__get_save_lock():
+            await self.__write_pending()
+            need_save = self.__load()
+        if need_save:
+            self.__save()
+        return changes
 
     def get_meme(self, meme_key: str) -> Optional[MemeInfo]:
         return self.__meme_dict.get(meme_key, None)
@@ -64,26 +187,80 @@ class MemeManager:
     def get_memes(self) -> list[MemeInfo]:
         return list(self.__meme_dict.values())
 
+    def get_sorted_indices(self, sort_by: SortBy, reverse: bool = False) -> np.ndarray:
+        """按指定方式排序后各表情在 `get_memes` 中的序号，在表情信息变化前会被缓存"""
+        if (indices := self.__sorted_indices.get((sort_by, reverse))) is None:
+            memes = self.get_memes()
+            if sort_by == "key":
+                keys: list[Any] = [meme.key for meme in memes]
+            elif sort_by == "keywords":
+                keys = [self.__get_pinyin_key(meme) for meme in memes]
+            elif sort_by == "date_created":
+                keys = [meme.date_created for meme in memes]
+            else:
+                keys = [meme.date_modified for meme in memes]
+            indices = np.array(
+                sorted(range(len(memes)), key=keys.__getitem__, reverse=reverse),
+                dtype=np.intp,
+            )
+            indices.flags.writeable = False
+            self.__sorted_indices[(sort_by, reverse)] = indices
+        return indices
+
+    def get_user_mask(self, user_id: str) -> np.ndarray:
+        """用户可用的表情，与 `get_memes` 顺序一致的布尔数组"""
+        if (mask := self.__user_masks.get(user_id)) is None:
+            mask = self.__default_mask.copy()
+            if exceptions := self.__exceptions.get(user_id):
+                indices = np.fromiter(exceptions, dtype=np.intp, count=len(exceptions))
+                mask[indices] = ~mask[indices]
+            mask.flags.writeable = False
+            self.__user_masks.set(user_id, mask)
+        return mask
+
+    def get_eligible_mask(self, image_num: int, text_num: int) -> np.ndarray:
+        """图片、文字数量符合要求的表情，与 `get_memes` 顺序一致的布尔数组"""
+        if (mask := self.__eligible_masks.get((image_num, text_num))) is None:
+            ranges = self.__params_ranges
+            mask = (
+                (ranges[:, 0] <= image_num)
+                & (image_num <= ranges[:, 1])
+                & (ranges[:, 2] <= text_num)
+                & (text_num <= ranges[:, 3])
+            )
+            mask.flags.writeable = False
+            self.__eligible_masks.set((image_num, text_num), mask)
+        return mask
+
     def block(self, user_id: str, meme_key: str):
         config = self.__meme_config[meme_key]
+        old_users = self.__get_listed_users(config)
         if config.mode == MemeMode.BLACK and user_id not in config.black_list:
             config.black_list.append(user_id)
         if config.mode == MemeMode.WHITE and user_id in config.white_list:
             config.white_list.remove(user_id)
-        self.__dump()
+        self.__update_permission(meme_key, old_users)
+        self.__user_masks.pop(user_id)
+        self.__save(meme_key)
 
     def unblock(self, user_id: str, meme_key: str):
         config = self.__meme_config[meme_key]
+        old_users = self.__get_listed_users(config)
         if config.mode == MemeMode.WHITE and user_id not in config.white_list:
             config.white_list.append(user_id)
         if config.mode == MemeMode.BLACK and user_id in config.black_list:
             config.black_list.remove(user_id)
-        self.__dump()
+        self.__update_permission(meme_key, old_users)
+        self.__user_masks.pop(user_id)
+        self.__save(meme_key)
 
     def change_mode(self, mode: MemeMode, meme_key: str):
         config = self.__meme_config[meme_key]
+        old_users = self.__get_listed_users(config)
         config.mode = mode
-        self.__dump()
+        self.__update_permission(meme_key, old_users)
+        self.__user_masks.clear()
+        self.__save(meme_key)
 
     def find(self, meme_name: str) -> list[MemeInfo]:
         meme_name = meme_name.lower()
@@ -119,27 +296,112 @@ class MemeManager:
         return list(result.values())
 
     def check(self, user_id: str, meme_key: str) -> bool:
-        if meme_key not in self.__meme_config:
+        if (index := self.__meme_indices.get(meme_key)) is None:
             return False
-        config = self.__meme_config[meme_key]
+        return bool(self.__default_mask[index]) != (
+            index in self.__exceptions.get(user_id, ())
+        )
+
+    @staticmethod
+    def __get_listed_users(config: MemeConfig) -> list[str]:
+        """当前模式下名单中的用户"""
         if config.mode == MemeMode.BLACK:
-            if user_id in config.black_list:
-                return False
-            return True
-        elif config.mode == MemeMode.WHITE:
-            if user_id in config.white_list:
-                return True
-            return False
-        return False
+            return list(config.black_list)
+        return list(config.white_list)
+
+    def __build_permissions(self):
+        self.__meme_indices = {
+            meme_key: index for index, meme_key in enumerate(self.__meme_dict)
+        }
+        self.__default_mask = np.zeros(len(self.__meme_indices), dtype=bool)
+        self.__exceptions = {}
+        self.__user_masks.clear()
+        for meme_key in self.__meme_indices:
+            self.__update_permission(meme_key, [])
+
+    def __update_permission(self, meme_key: str, old_users: list[str]):
+        if (index := self.__meme_indices.get(meme_key)) is None:
+            return
+        for user_id in old_users:
+            if (exceptions := self.__exceptions.get(user_id)) is not None:
+                exceptions.discard(index)
+                if not exceptions:
+                    del self.__exceptions[user_id]
+        if (config := self.__meme_config.get(meme_key)) is None:
+            # 尚未读取表情列表配置时，与 `MemeConfig` 的默认值一致
+            self.__default_mask[index] = True
+            return
+        self.__default_mask[index] = config.mode == MemeMode.BLACK
+        for user_id in self.__get_listed_users(config):
+            self.__exceptions.setdefault(user_id, set()).add(index)
 
-    def __load(self):
-        raw_list: dict[str, Any] = {}
+    async def __fetch_meme_infos(self, meme_keys: list[str]) -> dict[str, MemeInfo]:
+        try:
+            meme_infos = await get_meme_infos()
+        except Exception as e:
+            logger.debug(f"批量获取表情信息失败，将逐个获取：{e}")
+            meme_infos = None
+        if meme_infos is not None:
+            infos = {info.key: info for info in meme_infos}
+            if all(meme_key in infos for meme_key in meme_keys):
+                return {meme_key: infos[meme_key] for meme_key in meme_keys}
+
+        semaphore = asyncio.Semaphore(memes_config.memes_fetch_info_concurrency)
+
+        async def fetch(meme_key: str) -> MemeInfo:
+            async with semaphore:
+                return await get_meme_info(meme_key)
+
+        results = await asyncio.gather(*[fetch(meme_key) for meme_key in meme_keys])
+        return dict(zip(meme_keys, results))
+
+    async def flush(self):
+        """立即写入尚未保存的表情列表配置"""
+        async with self.__get_save_lock():
+            await self.__write_pending()
+
+    def __get_save_lock(self) -> asyncio.Lock:
+        # 在事件循环中创建，避免 Python 3.9 中绑定到其他事件循环
+        if self.__save_lock is None:
+            self.__save_lock = asyncio.Lock()
+        return self.__save_lock
+
+    async def __write_pending(self):
+        """写入尚未保存的配置，直到写入期间没有新的修改"""
+        while (data := self.__collect()) is not None:
+            await run_sync(self.__write)(*data)
+
+    def __read_config(self) -> dict[str, Any]:
+        if self.__format == "jsonl" and self.__jsonl_path.exists():
+            raw_list: dict[str, Any] = {}
+            with self.__jsonl_path.open("r", encoding="utf-8") as f:
+                lines = 0
+                for line in f:
+                    if not line.strip():
+                        continue
+                    lines += 1
+                    try:
+                        item = json.loads(line)
+                        # 同一表情以最后一行为准
+                        raw_list[item.pop("key")] = item
+                    except Exception:
+                        logger.warning(f"表情列表第 {lines} 行解析失败，已忽略")
+            self.__jsonl_lines = lines
+            return raw_list
+        if self.__format == "jsonl":
+            # 由 YAML 格式迁移时，需要完整写入一次
+            self.__full_save = True
         if self.__path.exists():
             with self.__path.open("r", encoding="utf-8") as f:
                 try:
-                    raw_list = yaml.safe_load(f)
+                    return yaml.safe_load(f)
                 except Exception:
                     logger.warning("表情列表解析失败，将重新生成")
+        return {}
+
+    def __load(self) -> bool:
+        """读取表情列表配置，返回是否需要保存（配置中缺少部分表情）"""
+        raw_list = self.__read_config()
         try:
             meme_list = {
                 name: type_validate_python(MemeConfig, config)
@@ -152,37 +414,191 @@ class MemeManager:
             meme_key: MemeConfig() for meme_key in self.__meme_dict.keys()
         }
         self.__meme_config.update(meme_list)
+        self.__build_permissions()
+        return self.__full_save or any(
+            meme_key not in meme_list for meme_key in self.__meme_dict
+        )
+
+    def __save(self, meme_key: Optional[str] = None):
+        """保存表情列表配置；在事件循环中调用时延迟写入，合并短时间内的多次修改"""
+        if meme_key is None:
+            self.__full_save = True
+        else:
+            self.__dirty_keys.add(meme_key)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            if (data := self.__collect()) is not None:
+                self.__write(*data)
+            return
+        if self.__save_task is None or self.__save_task.done():
+            self.__save_task = loop.create_task(self.__save_later())
 
-    def __dump(self):
-        self.__path.parent.mkdir(parents=True, exist_ok=True)
-        meme_list = {
-            name: model_dump(config) for name, config in self.__meme_config.items()
+    async def __save_later(self):
+        await asyncio.sleep(memes_config.memes_manager_save_delay)
+        await self.flush()
+
+    def __collect(self) -> Optional[tuple[bool, list[dict[str, Any]]]]:
+        """取出需要写入的配置，返回是否完整写入及各表情的配置"""
+        if not self.__full_save and not self.__dirty_keys:
+            return None
+        full = (
+            self.__full_save
+            or self.__format == "yaml"
+            # 追加的行数过多时重新整理文件
+            or self.__jsonl_lines + len(self.__dirty_keys)
+            > 2 * len(self.__meme_config) + 100
+        )
+        meme_keys = self.__meme_config.keys() if full else self.__dirty_keys
+        items = [
+            {"key": meme_key, **model_dump(self.__meme_config[meme_key])}
+            for meme_key in meme_keys
+            if meme_key in self.__meme_config
+        ]
+        self.__full_save = False
+        self.__dirty_keys = set()
+        return full, items
+
+    def __write(self, full: bool, items: list[dict[str, Any]]):
+        path = self.__jsonl_path if self.__format == "jsonl" else self.__path
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if not full:
+                with path.open("a", encoding="utf-8") as f:
+                    for item in items:
+                        f.write(json.dumps(item, ensure_ascii=False) + "\n")
+                self.__jsonl_lines += len(items)
+                return
+            tmp_path = path.with_suffix(".tmp")
+            with tmp_path.open("w", encoding="utf-8") as f:
+                if self.__format == "jsonl":
+                    for item in items:
+                        f.write(json.dumps(item, ensure_ascii=False) + "\n")
+                else:
+                    meme_list = {item.pop("key"): item for item in items}
+                    yaml.dump(meme_list, f, allow_unicode=True)
+            os.replace(tmp_path, path)
+            self.__jsonl_lines = len(items)
+        except OSError as e:
+            logger.warning(f"表情列表保存失败：{e}")
+
+    def __dump_snapshot(self):
+        snapshot = {
+            "version": self.__snapshot_version,
+            "memes": [model_dump(meme) for meme in self.__meme_dict.values()],
         }
-        with self.__path.open("w", encoding="utf-8") as f:
-            yaml.dump(meme_list, f, allow_unicode=True)
+        try:
+            self.__snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+            self.__snapshot_path.write_text(
+                json.dumps(snapshot, ensure_ascii=False, default=_json_default),
+                encoding="utf-8",
+            )
+        except Exception as e:
+            logger.warning(f"表情信息快照保存失败：{e}")
+
+    def __update(self, meme_dict: dict[str, MemeInfo]) -> MemeChanges:
+        """根据 `date_modified` 对比表情信息，只更新变化的部分"""
+        changes = MemeChanges()
+        for meme_key, meme in self.__meme_dict.items():
+            if meme_key not in meme_dict:
+                changes.removed.append(meme)
+        for meme_key, meme in meme_dict.items():
+            if (old_meme := self.__meme_dict.get(meme_key)) is None:
+                changes.added.append(meme)
+            elif old_meme.date_modified != meme.date_modified:
+                changes.modified.append(meme)
+            else:
+                meme_dict[meme_key] = old_meme
 
-    def __refresh_names(self):
-        self.__meme_names = {}
+        for meme in changes.removed + changes.modified:
+            self.__remove_index(self.__meme_dict[meme.key])
+        for meme in changes.added + changes.modified:
+            self.__add_index(meme)
+        self.__meme_dict = meme_dict
+        if changes:
+            self.__update_catalogue(changes)
+        return changes
+
+    def __update_catalogue(self, changes: MemeChanges):
+        for meme in changes.removed + changes.modified:
+            self.__pinyin_keys.pop(meme.key, None)
+        self.__sorted_indices.clear()
+        self.__build_permissions()
+        self.__params_ranges = np.array(
+            [
+                [
+                    meme.params_type.min_images,
+                    meme.params_type.max_images,
+                    meme.params_type.min_texts,
+                    meme.params_type.max_texts,
+                ]
+                for meme in self.__meme_dict.values()
+            ],
+            dtype=np.int64,
+        ).reshape(-1, 4)
+        self.__eligible_masks.clear()
+        hasher = hashlib.md5()
         for meme in self.__meme_dict.values():
-            names = set()
-            names.add(meme.key.lower())
-            for keyword in meme.keywords:
-                names.add(keyword.lower())
-            for shortcut in meme.shortcuts:
-                names.add((shortcut.humanized or shortcut.key).lower())
+            item = [
+                meme.key,
+                meme.keywords,
+                [shortcut.humanized or shortcut.key for shortcut in meme.shortcuts],
+                sorted(meme.tags),
+                meme.date_modified.timestamp(),
+            ]
+            hasher.update(json.dumps(item, ensure_ascii=False).encode("utf8"))
+        self.__catalogue_stamp = hasher.hexdigest()
+
+    def __get_pinyin_key(self, meme: MemeInfo) -> str:
+        if (key := self.__pinyin_keys.get(meme.key)) is None:
+            key = "".join(
+                chain.from_iterable(pinyin(meme.keywords[0], style=Style.TONE3))
+            )
+            self.__pinyin_keys[meme.key] = key
+        return key
+
+    @staticmethod
+    def __get_names(meme: MemeInfo) -> set[str]:
+        names = set()
+        names.add(meme.key.lower())
+        for keyword in meme.keywords:
+            names.add(keyword.lower())
+        for shortcut in meme.shortcuts:
+            names.add((shortcut.humanized or shortcut.key).lower())
+        return names
+
+    @staticmethod
+    def __get_tags(meme: MemeInfo) -> set[str]:
+        return {tag.lower() for tag in meme.tags}
+
+    def __add_index(self, meme: MemeInfo):
+        for index, names in (
+            (self.__meme_names, self.__get_names(meme)),
+            (self.__meme_tags, self.__get_tags(meme)),
+        ):
             for name in names:
-                if name not in self.__meme_names:
-                    self.__meme_names[name] = []
-                self.__meme_names[name].append(meme)
+                memes = index.get(name, [])
+                # 保持与全量构建时相同的顺序
+                index[name] = sorted(memes + [meme], key=lambda meme: meme.key)
 
-    def __refresh_tags(self):
-        self.__meme_tags = {}
-        for meme in self.__meme_dict.values():
-            for tag in meme.tags:
-                tag = tag.lower()
-                if tag not in self.__meme_tags:
-                    self.__meme_tags[tag] = []
-                self.__meme_tags[tag].append(meme)
+    def __remove_index(self, meme: MemeInfo):
+        for index, names in (
+            (self.__meme_names, self.__get_names(meme)),
+            (self.__meme_tags, self.__get_tags(meme)),
+        ):
+            for name in names:
+                memes = [m for m in index.get(name, []) if m.key != meme.key]
+                if memes:
+                    index[name] = memes
+                else:
+                    index.pop(name, None)
 
 
 meme_manager = MemeManager()
+
+driver = get_driver()
+
+
+@driver.on_shutdown
+async def _():
+    await meme_manager.flush()
@@ -1,6 +1,8 @@
 from . import command as command
+from . import export as export
 from . import help as help
 from . import info as info
 from . import manage as manage
 from . import search as search
 from . import statistics as statistics
+from . import status as status
@@ -1,10 +1,15 @@
 import asyncio
 import random
+import re
 import traceback
-from typing import Any, NoReturn, Union
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional, Union
 
+import numpy as np
+from arclet.alconna import Arparma, command_manager, output_manager
 from arclet.alconna import config as alc_config
-from nonebot import get_driver
+from nonebot import get_driver, get_plugin_config, on_message
 from nonebot.adapters import Bot, Event
 from nonebot.exception import AdapterException
 from nonebot.log import logger
@@ -23,20 +28,49 @@ from nonebot_plugin_alconna import (
     on_alconna,
 )
 from nonebot_plugin_alconna.builtins.extensions.reply import ReplyMergeExtension
+from nonebot_plugin_alconna.config import Config as AlconnaConfig
 from nonebot_plugin_alconna.uniseg.tools import image_fetch
 from nonebot_plugin_uninfo import Interface, QryItrface, Session, Uninfo, User
 
+from ..cache import TTLCache, image_cache, prewarm_meme_previews, result_cache
 from ..config import memes_config
+from ..counter import usage_counter
 from ..exception import MemeGeneratorException
-from ..manager import meme_manager
-from ..recorder import record_meme_generation
-from ..request import MemeInfo, generate_meme
+from ..manager import MemeChanges, meme_manager
+from ..recorder import (
+    SessionIdType,
+    counter_scope_key,
+    get_popular_meme_keys,
+    record_meme_generation,
+    scope_value,
+)
+from ..request import MemeInfo, generate_meme, get_meme_options
 from ..utils import NetworkError
 from .utils import UserId
 
 alc_config.command_max_count += 1000
 
 
+def image_cache_key(bot: Bot, image: Image) -> Optional[str]:
+    if image.url:
+        return image.url
+    if image.id:
+        return f"{bot.adapter.get_name()}_{bot.self_id}_{image.id}"
+    return None
+
+
+async def fetch_image(bot: Bot, event: Event, state: T_State, image: Image) -> bytes:
+    async def fetch() -> bytes:
+        result = await image_fetch(event, bot, state, image)
+        if not isinstance(result, bytes):
+            raise NotImplementedError
+        return result
+
+    if key := image_cache_key(bot, image):
+        return await image_cache.get_or_fetch(key, fetch)
+    return await fetch()
+
+
 async def process(
     bot: Bot,
     event: Event,
@@ -53,11 +87,11 @@ async def process(
     image_contents: list[bytes] = []
 
     try:
-        for image in images:
-            result = await image_fetch(event, bot, state, image)
-            if not isinstance(result, bytes):
-                raise NotImplementedError
-            image_contents.append(result)
+        image_contents = list(
+            await asyncio.gather(
+                *[fetch_image(bot, event, state, image) for image in images]
+            )
+        )
     except NotImplementedError:
         await matcher.finish("当前平台可能不支持获取图片")
     except (NetworkError, AdapterException):
@@ -74,9 +108,17 @@ async def process(
     args["user_infos"] = args_user_infos
 
     try:
-        result = await generate_meme(
-            meme_key=meme.key, images=image_contents, texts=texts, args=args
-        )
+        if memes_config.memes_result_cache_enabled:
+            cache_key = result_cache.make_key(meme.key, image_contents, texts, args)
+            if (result := await result_cache.get(cache_key)) is None:
+                result = await generate_meme(
+                    meme_key=meme.key, images=image_contents, texts=texts, args=args
+                )
+                await result_cache.set(cache_key, result)
+        else:
+            result = await generate_meme(
+                meme_key=meme.key, images=image_contents, texts=texts, args=args
+            )
         await record_meme_generation(session, meme.key)
     except MemeGeneratorException as e:
         await matcher.finish(e.message)
@@ -89,11 +131,75 @@ async def process(
     await msg.send()
 
 
+user_cache: TTLCache[User] = TTLCache(
+    max_items=4096, ttl=memes_config.memes_user_cache_ttl
+)
+
 T_MemeParams = Union[Text, Image, At]
 meme_params_key = "meme_params"
 arg_meme_params = Args[meme_params_key, MultiVar(T_MemeParams, "*")]
 
 
+@dataclass
+class UserFetchStats:
+    """获取用户信息时调用适配器接口的统计，失败的调用也计入"""
+
+    adapter_calls: int = 0
+    adapter_errors: int = 0
+
+
+user_fetch_stats = UserFetchStats()
+
+
+async def fetch_user(
+    session: Session, interface: Interface, user_id: str, use_member: bool
+) -> Optional[User]:
+    use_member = use_member and session.scene.type > 0
+    cache_key = (
+        scope_value(session.scope),
+        session.self_id,
+        session.scene.type.value if use_member else None,
+        session.scene.id if use_member else None,
+        user_id,
+    )
+    if user := user_cache.get(cache_key):
+        return replace(user)
+
+    user = None
+    if use_member:
+        user_fetch_stats.adapter_calls += 1
+        try:
+            if member := await interface.get_member(
+                session.scene.type, session.scene.id, user_id
+            ):
+                user = member.user
+                if member.nick:
+                    user.nick = member.nick
+        except (NotImplementedError, NetworkError, AdapterException):
+            user_fetch_stats.adapter_errors += 1
+    if not user:
+        user_fetch_stats.adapter_calls += 1
+        try:
+            user = await interface.get_user(user_id)
+        except Exception:
+            user_fetch_stats.adapter_errors += 1
+            raise
+    if user:
+        user_cache.set(cache_key, replace(user))
+    return user
+
+
+def mentioned_user(msg_seg: T_MemeParams) -> Optional[tuple[str, bool]]:
+    """返回消息段中提及的用户 id，以及是否需要获取成员信息"""
+    if isinstance(msg_seg, At):
+        return msg_seg.target, True
+    if isinstance(msg_seg, Text):
+        text = msg_seg.text
+        if text.startswith("@") and (user_id := text[1:]):
+            return user_id, False
+    return None
+
+
 async def handle_params(
     matcher: Matcher,
     session: Session,
@@ -104,22 +210,23 @@ async def handle_params(
     images: list[Image] = []
     users: list[User] = []
 
+    # 并发获取所有提及的用户信息
+    results = await asyncio.gather(
+        *[
+            fetch_user(session, interface, *mentioned)
+            for msg_seg in meme_params
+            if (mentioned := mentioned_user(msg_seg))
+        ],
+        return_exceptions=True,
+    )
+    user_results = iter(results)
+
     for msg_seg in meme_params:
         if isinstance(msg_seg, At):
             try:
-                user = None
-                if session.scene.type > 0:
-                    try:
-                        if member := await interface.get_member(
-                            session.scene.type, session.scene.id, msg_seg.target
-                        ):
-                            user = member.user
-                            if member.nick:
-                                user.nick = member.nick
-                    except (NotImplementedError, NetworkError, AdapterException):
-                        pass
-                if not user:
-                    user = await interface.get_user(msg_seg.target)
+                user = next(user_results)
+                if isinstance(user, BaseException):
+                    raise user
                 if user:
                     if image_url := user.avatar:
                         images.append(Image(url=image_url))
@@ -135,9 +242,12 @@ async def handle_params(
 
         elif isinstance(msg_seg, Text):
             text = msg_seg.text
-            if text.startswith("@") and (user_id := text[1:]):
+            if mentioned_user(msg_seg):
                 try:
-                    if user := await interface.get_user(user_id):
+                    user = next(user_results)
+                    if isinstance(user, BaseException):
+                        raise user
+                    if user:
                         if image_url := user.avatar:
                             images.append(Image(url=image_url))
                         users.append(user)
@@ -161,30 +271,117 @@ async def handle_params(
     return texts, images, users
 
 
-matchers: list[type[Matcher]] = []
+matchers: dict[str, type[Matcher]] = {}
 
 prefixes = list(get_driver().config.command_start)
 if (meme_prefixes := memes_config.memes_command_prefixes) is not None:
     prefixes = meme_prefixes
 
 
-def create_matcher(meme: MemeInfo):
-    options = [
-        opt.option()
-        for opt in (
-            meme.params_type.args_type.parser_options
-            if meme.params_type.args_type
-            else []
+async def params_error(matcher: Matcher, msg: str):
+    logger.info(msg)
+    if memes_config.memes_prompt_params_error:
+        matcher.stop_propagation()
+        await matcher.finish(msg)
+
+
+async def handle_meme(
+    bot: Bot,
+    event: Event,
+    state: T_State,
+    matcher: Matcher,
+    user_id: str,
+    session: Session,
+    interface: Interface,
+    meme: MemeInfo,
+    alc_matches: Arparma,
+) -> bool:
+    if not meme_manager.check(user_id, meme.key):
+        logger.info(f"用户 {user_id} 表情 {meme.key} 被禁用")
+        return False
+
+    args: dict[str, Any] = {}
+    options = alc_matches.options
+    for option, option_result in options.items():
+        if option_result.value is None:
+            args.update(option_result.args)
+        else:
+            args[option] = option_result.value
+
+    meme_params: list[T_MemeParams] = list(alc_matches.query(meme_params_key, ()))
+    texts, images, users = await handle_params(matcher, session, interface, meme_params)
+
+    # 当所需图片数为 2 且已指定图片数为 1 时，使用发送者的头像作为第一张图
+    if meme.params_type.min_images == 2 and len(images) == 1:
+        user = session.user
+        if image_url := user.avatar:
+            images.insert(0, Image(url=image_url))
+        if (member := session.member) and member.nick:
+            user.nick = member.nick
+        users.insert(0, user)
+
+    # 当所需图片数为 1 且没有已指定图片时，使用发送者的头像
+    if memes_config.memes_use_sender_when_no_image and (
+        meme.params_type.min_images == 1 and len(images) == 0
+    ):
+        user = session.user
+        if image_url := user.avatar:
+            images.append(Image(url=image_url))
+        if (member := session.member) and member.nick:
+            user.nick = member.nick
+        users.append(user)
+
+    # 当所需文字数 >0 且没有输入文字时，使用默认文字
+    if memes_config.memes_use_default_when_no_text and (
+        meme.params_type.min_texts > 0 and len(texts) == 0
+    ):
+        texts = meme.params_type.default_texts
+
+    if not (meme.params_type.min_images <= len(images) <= meme.params_type.max_images):
+        await params_error(
+            matcher,
+            f"输入图片数量不符，图片数量应为 {meme.params_type.min_images}"
+            + (
+                f" ~ {meme.params_type.max_images}"
+                if meme.params_type.max_images > meme.params_type.min_images
+                else ""
+            ),
+        )
+        return False
+    if not (meme.params_type.min_texts <= len(texts) <= meme.params_type.max_texts):
+        await params_error(
+            matcher,
+            f"输入文字数量不符，文字数量应为 {meme.params_type.min_texts}"
+            + (
+                f" ~ {meme.params_type.max_texts}"
+                if meme.params_type.max_texts > meme.params_type.min_texts
+                else ""
+            ),
         )
-    ]
+        return False
+
+    matcher.stop_propagation()
+    await process(bot, event, state, matcher, session, meme, images, texts, users, args)
+    return True
+
+
+def create_command(meme: MemeInfo) -> Alconna:
+    return Alconna(
+        prefixes,
+        meme.keywords[0],
+        *get_meme_options(meme),
+        arg_meme_params,
+        meta=CommandMeta(keep_crlf=True),
+    )
+
+
+def create_matcher(meme: MemeInfo):
+    if memes_config.memes_dispatch_mode:
+        dispatcher.add(meme)
+        return
+
     meme_matcher = on_alconna(
-        Alconna(
-            prefixes,
-            meme.keywords[0],
-            *options,
-            arg_meme_params,
-            meta=CommandMeta(keep_crlf=True),
-        ),
+        create_command(meme),
         aliases=set(meme.keywords[1:]),
         block=False,
         priority=12,
@@ -197,7 +394,7 @@ def create_matcher(meme: MemeInfo):
             prefix=True,
             humanized=shortcut.humanized,
         )
-    matchers.append(meme_matcher)
+    matchers[meme.key] = meme_matcher
 
     @meme_matcher.handle()
     async def _(
@@ -210,81 +407,136 @@ def create_matcher(meme: MemeInfo):
         interface: QryItrface,
         alc_matches: AlcMatches,
     ):
-        if not meme_manager.check(user_id, meme.key):
-            logger.info(f"用户 {user_id} 表情 {meme.key} 被禁用")
-            return
-
-        args: dict[str, Any] = {}
-        options = alc_matches.options
-        for option, option_result in options.items():
-            if option_result.value is None:
-                args.update(option_result.args)
-            else:
-                args[option] = option_result.value
-
-        meme_params: list[T_MemeParams] = list(alc_matches.query(meme_params_key, ()))
-        texts, images, users = await handle_params(
-            matcher, session, interface, meme_params
+        await handle_meme(
+            bot, event, state, matcher, user_id, session, interface, meme, alc_matches
         )
 
-        # 当所需图片数为 2 且已指定图片数为 1 时，使用发送者的头像作为第一张图
-        if meme.params_type.min_images == 2 and len(images) == 1:
-            user = session.user
-            if image_url := user.avatar:
-                images.insert(0, Image(url=image_url))
-            if (member := session.member) and member.nick:
-                user.nick = member.nick
-            users.insert(0, user)
-
-        # 当所需图片数为 1 且没有已指定图片时，使用发送者的头像
-        if memes_config.memes_use_sender_when_no_image and (
-            meme.params_type.min_images == 1 and len(images) == 0
-        ):
-            user = session.user
-            if image_url := user.avatar:
-                images.append(Image(url=image_url))
-            if (member := session.member) and member.nick:
-                user.nick = member.nick
-            users.append(user)
-
-        # 当所需文字数 >0 且没有输入文字时，使用默认文字
-        if memes_config.memes_use_default_when_no_text and (
-            meme.params_type.min_texts > 0 and len(texts) == 0
-        ):
-            texts = meme.params_type.default_texts
-
-        async def finish(msg: str) -> NoReturn:
-            logger.info(msg)
-            if memes_config.memes_prompt_params_error:
-                matcher.stop_propagation()
-                await matcher.finish(msg)
-            await matcher.finish()
 
-        if not (
-            meme.params_type.min_images <= len(images) <= meme.params_type.max_images
-        ):
-            await finish(
-                f"输入图片数量不符，图片数量应为 {meme.params_type.min_images}"
-                + (
-                    f" ~ {meme.params_type.max_images}"
-                    if meme.params_type.max_images > meme.params_type.min_images
-                    else ""
-                )
-            )
-        if not (meme.params_type.min_texts <= len(texts) <= meme.params_type.max_texts):
-            await finish(
-                f"输入文字数量不符，文字数量应为 {meme.params_type.min_texts}"
-                + (
-                    f" ~ {meme.params_type.max_texts}"
-                    if meme.params_type.max_texts > meme.params_type.min_texts
-                    else ""
-                )
+class MemeDispatcher:
+    """表情分发器
+
+    只注册一个响应器，先通过关键词哈希表找到可能的表情，
+    再为匹配到的表情按需创建并缓存 Alconna 命令进行解析
+    """
+
+    def __init__(self):
+        self.__keywords: dict[str, list[str]] = {}
+        self.__shortcuts: dict[str, list[re.Pattern[str]]] = {}
+        self.__commands: dict[str, Alconna] = {}
+
+    def add(self, meme: MemeInfo):
+        for keyword in meme.keywords:
+            self.__keywords.setdefault(keyword, []).append(meme.key)
+        if meme.shortcuts:
+            self.__shortcuts[meme.key] = [
+                re.compile(shortcut.key) for shortcut in meme.shortcuts
+            ]
+
+    def remove(self, meme_key: str):
+        for keyword, meme_keys in list(self.__keywords.items()):
+            if meme_key in meme_keys:
+                meme_keys.remove(meme_key)
+                if not meme_keys:
+                    del self.__keywords[keyword]
+        self.__shortcuts.pop(meme_key, None)
+        if command := self.__commands.pop(meme_key, None):
+            command_manager.delete(command)
+
+    def clear(self):
+        for meme_key in list(self.__commands.keys()):
+            self.remove(meme_key)
+        self.__keywords.clear()
+        self.__shortcuts.clear()
+
+    def lookup(self, text: str) -> list[str]:
+        if not (text := text.lstrip()):
+            return []
+        name = text.split(maxsplit=1)[0]
+        meme_keys: list[str] = []
+        for prefix in prefixes:
+            if not name.startswith(prefix):
+                continue
+            keyword = name[len(prefix) :]
+            meme_keys.extend(self.__keywords.get(keyword, []))
+            for meme_key, patterns in self.__shortcuts.items():
+                if any(pattern.match(keyword) for pattern in patterns):
+                    meme_keys.append(meme_key)
+        return list(dict.fromkeys(meme_keys))
+
+    def get_command(self, meme: MemeInfo) -> Alconna:
+        if command := self.__commands.get(meme.key):
+            return command
+        command = create_command(meme)
+        # 与 `on_alconna` 注册别名的方式一致
+        for keyword in meme.keywords[1:]:
+            command.shortcut(keyword, prefix=True, compact=None)
+        for shortcut in meme.shortcuts:
+            command.shortcut(
+                shortcut.key,
+                arguments=shortcut.args,
+                prefix=True,
+                humanized=shortcut.humanized,
             )
+        self.__commands[meme.key] = command
+        return command
 
-        matcher.stop_propagation()
-        await process(
-            bot, event, state, matcher, session, meme, images, texts, users, args
-        )
+
+dispatcher = MemeDispatcher()
+alconna_auto_send_output = (
+    get_plugin_config(AlconnaConfig).alconna_auto_send_output is not False
+)
+dispatcher_state_key = "meme_keys"
+reply_merge_extension = ReplyMergeExtension()
+
+
+async def dispatcher_rule(event: Event, state: T_State) -> bool:
+    if not memes_config.memes_dispatch_mode:
+        return False
+    try:
+        text = event.get_plaintext()
+    except (NotImplementedError, ValueError):
+        return False
+    if meme_keys := dispatcher.lookup(text):
+        state[dispatcher_state_key] = meme_keys
+        return True
+    return False
+
+
+dispatcher_matcher = on_message(rule=dispatcher_rule, block=False, priority=12)
+
+
+@dispatcher_matcher.handle()
+async def _(
+    bot: Bot,
+    event: Event,
+    state: T_State,
+    matcher: Matcher,
+    user_id: UserId,
+    session: Uninfo,
+    interface: QryItrface,
+):
+    msg = await reply_merge_extension.message_provider(event, state, bot)
+    if not msg:
+        return
+    for meme_key in state[dispatcher_state_key]:
+        if not (meme := meme_manager.get_meme(meme_key)):
+            continue
+        command = dispatcher.get_command(meme)
+        # 与 `on_alconna` 相同，捕获帮助信息等输出并发送给用户
+        with output_manager.capture(command.name) as cap:
+            output_manager.set_action(lambda x: x, command.name)
+            alc_matches = command.parse(msg)
+            output: Optional[str] = cap.get("output", None)
+        if output:
+            if alconna_auto_send_output:
+                await matcher.send(output)
+            return
+        if not alc_matches.matched:
+            continue
+        if await handle_meme(
+            bot, event, state, matcher, user_id, session, interface, meme, alc_matches
+        ):
+            return
 
 
 def create_matchers():
@@ -293,9 +545,40 @@ def create_matchers():
 
 
 def destroy_matchers():
-    for matcher in matchers:
+    for matcher in matchers.values():
         matcher.destroy()
     matchers.clear()
+    dispatcher.clear()
+
+
+def update_matchers(changes: MemeChanges):
+    """只销毁和创建有变化的表情对应的响应器"""
+    for meme in changes.removed + changes.modified:
+        if matcher := matchers.pop(meme.key, None):
+            matcher.destroy()
+        dispatcher.remove(meme.key)
+    for meme in changes.added + changes.modified:
+        create_matcher(meme)
+
+
+def random_meme_weights(
+    session: Session, memes: list[MemeInfo], indices: np.ndarray
+) -> Optional[list[int]]:
+    """按最近的调用次数计算随机表情的权重，计数器无法给出结果时返回 `None`"""
+    if (hours := memes_config.memes_random_meme_weight_hours) <= 0:
+        return None
+    # 按整点统计，截止到当前小时结束
+    stop = datetime.now(timezone.utc).replace(
+        minute=0, second=0, microsecond=0
+    ) + timedelta(hours=1)
+    start = stop - timedelta(hours=hours)
+    if (
+        counts := usage_counter.query(
+            counter_scope_key(session, SessionIdType.GLOBAL), [start, stop]
+        )
+    ) is None:
+        return None
+    return [counts[(0, memes[index].key)] + 1 for index in indices]
 
 
 random_matcher = on_alconna(
@@ -321,19 +604,19 @@ async def _(
     meme_params: list[T_MemeParams] = list(alc_matches.query(meme_params_key, ()))
     texts, images, users = await handle_params(matcher, session, interface, meme_params)
 
-    available_memes = [
-        meme
-        for meme in meme_manager.get_memes()
-        if meme_manager.check(user_id, meme.key)
-        and (
-            (meme.params_type.min_images <= len(images) <= meme.params_type.max_images)
-            and (meme.params_type.min_texts <= len(texts) <= meme.params_type.max_texts)
-        )
-    ]
-    if not available_memes:
+    memes = meme_manager.get_memes()
+    indices = np.flatnonzero(
+        meme_manager.get_user_mask(user_id)
+        & meme_manager.get_eligible_mask(len(images), len(texts))
+    )
+    if not len(indices):
         await matcher.finish("找不到符合参数数量的表情")
 
-    random_meme = random.choice(available_memes)
+    if (weights := random_meme_weights(session, memes, indices)) is not None:
+        index = random.choices(indices, weights=weights)[0]
+    else:
+        index = random.choice(indices)
+    random_meme = memes[index]
     await process(
         bot,
         event,
@@ -353,10 +636,17 @@ refresh_matcher = on_alconna("更新表情", aliases={"刷新表情"}, block=Tru
 
 @refresh_matcher.handle()
 async def _(matcher: Matcher):
-    destroy_matchers()
-    await meme_manager.init()
-    create_matchers()
-    await matcher.finish("表情更新成功")
+    changes = await meme_manager.init(force=True)
+    update_matchers(changes)
+    await matcher.finish(
+        "表情更新成功"
+        + (
+            f"，新增 {len(changes.added)} 个，删除 {len(changes.removed)} 个，"
+            f"更新 {len(changes.modified)} 个"
+            if changes
+            else ""
+        )
+    )
 
 
 from nonebot import get_driver
@@ -365,10 +655,34 @@ driver = get_driver()
 
 
 async def init():
-    await meme_manager.init()
-    create_matchers()
+    update_matchers(await meme_manager.init())
+
+    if prewarm_count := memes_config.memes_preview_prewarm_count:
+        meme_keys = await get_popular_meme_keys(
+            prewarm_count, time_start=datetime.now(timezone.utc) - timedelta(days=30)
+        )
+        await prewarm_meme_previews(
+            [
+                meme
+                for meme_key in meme_keys
+                if (meme := meme_manager.get_meme(meme_key))
+            ]
+        )
 
 
 @driver.on_startup
 async def _():
+    # 先使用快照创建响应器，再在后台与 meme-generator 同步
+    if meme_manager.load_snapshot():
+        create_matchers()
     asyncio.create_task(init())
+
+
+@driver.on_shutdown
+async def _():
+    if user_fetch_stats.adapter_calls:
+        logger.info(
+            f"用户信息缓存命中 {user_cache.hits} 次，未命中 {user_cache.misses} 次；"
+            f"获取用户信息调用适配器接口 {user_fetch_stats.adapter_calls} 次，"
+            f"失败 {user_fetch_stats.adapter_errors} 次"
+        )
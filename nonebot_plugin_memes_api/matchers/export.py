@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+from typing import Optional
+
+from nonebot.matcher import Matcher
+from nonebot.permission import SUPERUSER
+from nonebot_plugin_alconna import Alconna, Args, on_alconna
+
+from ..export import export_meme_generation_records
+
+export_matcher = on_alconna(
+    Alconna("导出表情调用记录", Args["date_start?", str]["date_stop?", str]),
+    block=True,
+    priority=11,
+    use_cmd_start=True,
+    permission=SUPERUSER,
+)
+
+
+def parse_date(date: str) -> Optional[datetime]:
+    try:
+        return datetime.strptime(date, "%Y-%m-%d").astimezone()
+    except ValueError:
+        return None
+
+
+@export_matcher.handle()
+async def _(
+    matcher: Matcher,
+    date_start: Optional[str] = None,
+    date_stop: Optional[str] = None,
+):
+    time_start = None
+    time_stop = None
+    if date_start and not (time_start := parse_date(date_start)):
+        await matcher.finish(f"日期格式错误：{date_start}，应为 YYYY-MM-DD")
+    if date_stop:
+        if not (time_stop := parse_date(date_stop)):
+            await matcher.finish(f"日期格式错误：{date_stop}，应为 YYYY-MM-DD")
+        # 包含结束日期当天
+        time_stop += timedelta(days=1)
+
+    count, files = await export_meme_generation_records(
+        time_start=time_start, time_stop=time_stop
+    )
+    if not count:
+        await matcher.finish("暂时没有表情调用记录")
+    await matcher.finish(
+        f"已导出 {count} 条表情调用记录：\n" + "\n".join(str(file) for file in files)
+    )
@@ -1,19 +1,20 @@
 import hashlib
+import json
 from datetime import datetime, timedelta, timezone
-from itertools import chain
 
 from nonebot_plugin_alconna import Image, Text, on_alconna
-from nonebot_plugin_localstore import get_cache_dir
 from nonebot_plugin_uninfo import Uninfo
-from pypinyin import Style, pinyin
 
+from ..cache import TTLCache, list_image_cache
 from ..config import memes_config
 from ..manager import meme_manager
-from ..recorder import SessionIdType, get_meme_generation_keys
+from ..recorder import SessionIdType, get_hot_meme_keys
 from ..request import MemeKeyWithProperties, render_meme_list
 from .utils import UserId
 
-memes_cache_dir = get_cache_dir("nonebot_plugin_memes_api")
+hot_meme_keys_cache: TTLCache[dict[str, int]] = TTLCache(
+    max_items=16, ttl=memes_config.memes_list_image_config.label_hot_cache_ttl
+)
 
 help_matcher = on_alconna(
     "表情包制作",
@@ -26,75 +27,76 @@ help_matcher = on_alconna(
 
 @help_matcher.handle()
 async def _(user_id: UserId, session: Uninfo):
-    memes = meme_manager.get_memes()
     list_image_config = memes_config.memes_list_image_config
-
-    sort_by = list_image_config.sort_by
-    sort_reverse = list_image_config.sort_reverse
-    if sort_by == "key":
-        memes = sorted(memes, key=lambda meme: meme.key, reverse=sort_reverse)
-    elif sort_by == "keywords":
-        memes = sorted(
-            memes,
-            key=lambda meme: "".join(
-                chain.from_iterable(pinyin(meme.keywords[0], style=Style.TONE3))
-            ),
-            reverse=sort_reverse,
-        )
-    elif sort_by == "date_created":
-        memes = sorted(memes, key=lambda meme: meme.date_created, reverse=sort_reverse)
-    elif sort_by == "date_modified":
-        memes = sorted(memes, key=lambda meme: meme.date_modified, reverse=sort_reverse)
+    indices = meme_manager.get_sorted_indices(
+        list_image_config.sort_by, list_image_config.sort_reverse
+    )
+    all_memes = meme_manager.get_memes()
+    memes = [all_memes[index] for index in indices]
 
     label_new_timedelta = list_image_config.label_new_timedelta
     label_hot_threshold = list_image_config.label_hot_threshold
     label_hot_days = list_image_config.label_hot_days
 
-    meme_generation_keys = await get_meme_generation_keys(
-        session,
-        SessionIdType.GLOBAL,
-        time_start=datetime.now(timezone.utc) - timedelta(days=label_hot_days),
-    )
-
-    meme_list: list[MemeKeyWithProperties] = []
-    for meme in memes:
-        labels = []
-        if datetime.now() - meme.date_created < label_new_timedelta:
-            labels.append("new")
-        if meme_generation_keys.count(meme.key) >= label_hot_threshold:
-            labels.append("hot")
-        disabled = not meme_manager.check(user_id, meme.key)
-        meme_list.append(
-            MemeKeyWithProperties(meme_key=meme.key, disabled=disabled, labels=labels)
+    # 全局统计按机器人区分，与 `SessionIdType.GLOBAL` 的过滤条件一致
+    hot_cache_key = (session.self_id, session.scope)
+    if (hot_meme_keys := hot_meme_keys_cache.get(hot_cache_key)) is None:
+        hot_meme_keys = await get_hot_meme_keys(
+            session,
+            SessionIdType.GLOBAL,
+            label_hot_threshold,
+            # 按整点统计，以便直接使用内存中的调用计数
+            time_start=(
+                datetime.now(timezone.utc) - timedelta(days=label_hot_days)
+            ).replace(minute=0, second=0, microsecond=0),
         )
+        hot_meme_keys_cache.set(hot_cache_key, hot_meme_keys)
 
-    # cache rendered meme list
-    meme_list_hashable = [
-        (
-            {
-                "key": meme.key,
-                "keywords": meme.keywords,
-                "shortcuts": [
-                    shortcut.humanized or shortcut.key for shortcut in meme.shortcuts
-                ],
-                "tags": sorted(meme.tags),
-            },
-            prop,
-        )
-        for meme, prop in zip(memes, meme_list)
+    now = datetime.now()
+    new_meme_keys = [
+        meme.key for meme in memes if now - meme.date_created < label_new_timedelta
     ]
-    meme_list_hash = hashlib.md5(str(meme_list_hashable).encode("utf8")).hexdigest()
-    meme_list_cache_file = memes_cache_dir / f"{meme_list_hash}.jpg"
-    if not meme_list_cache_file.exists():
-        img = await render_meme_list(
+    disabled = (~meme_manager.get_user_mask(user_id)[indices]).tobytes()
+
+    # cache rendered meme list
+    hasher = hashlib.md5()
+    hasher.update(meme_manager.catalogue_stamp.encode("utf8"))
+    hasher.update(
+        json.dumps(
+            [
+                list_image_config.sort_by,
+                list_image_config.sort_reverse,
+                list_image_config.text_template,
+                list_image_config.add_category_icon,
+                new_meme_keys,
+                sorted(hot_meme_keys),
+            ],
+            ensure_ascii=False,
+        ).encode("utf8")
+    )
+    hasher.update(disabled)
+
+    async def render() -> bytes:
+        new_meme_key_set = set(new_meme_keys)
+        meme_list: list[MemeKeyWithProperties] = []
+        for meme, meme_disabled in zip(memes, disabled):
+            labels = []
+            if meme.key in new_meme_key_set:
+                labels.append("new")
+            if meme.key in hot_meme_keys:
+                labels.append("hot")
+            meme_list.append(
+                MemeKeyWithProperties(
+                    meme_key=meme.key, disabled=bool(meme_disabled), labels=labels
+                )
+            )
+        return await render_meme_list(
             meme_list,
             text_template=list_image_config.text_template,
             add_category_icon=list_image_config.add_category_icon,
         )
-        with open(meme_list_cache_file, "wb") as f:
-            f.write(img)
-    else:
-        img = meme_list_cache_file.read_bytes()
+
+    img = await list_image_cache.get_or_render(f"{hasher.hexdigest()}.jpg", render)
 
     msg = Text(
         "触发方式：“关键词 + 图片/文字”\n"
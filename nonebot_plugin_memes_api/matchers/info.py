@@ -2,7 +2,8 @@ from arclet.alconna import TextFormatter
 from nonebot.matcher import Matcher
 from nonebot_plugin_alconna import Alconna, Args, Image, Text, on_alconna
 
-from ..request import generate_meme_preview
+from ..cache import get_meme_preview
+from ..request import get_meme_options
 from .utils import find_meme
 
 info_matcher = on_alconna(
@@ -35,10 +36,9 @@ async def _(matcher: Matcher, meme_name: str):
     default_texts = ", ".join([f'"{text}"' for text in meme.params_type.default_texts])
 
     args_info = ""
-    if args_type := meme.params_type.args_type:
+    if options := get_meme_options(meme):
         formater = TextFormatter()
-        for option in args_type.parser_options:
-            opt = option.option()
+        for opt in options:
             alias_text = (
                 " ".join(opt.requires)
                 + (" " if opt.requires else "")
@@ -60,5 +60,5 @@ async def _(matcher: Matcher, meme_name: str):
         + (f"\n可选参数：{args_info}" if args_info else "")
     )
     info += "\n表情预览：\n"
-    img = await generate_meme_preview(meme.key)
+    img = await get_meme_preview(meme)
     await (Text(info) + Image(raw=img)).finish()
@@ -1,7 +1,6 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import Any, Optional, Union
 
-from dateutil.relativedelta import relativedelta
 from nonebot.matcher import Matcher
 from nonebot_plugin_alconna import (
     Alconna,
@@ -15,14 +14,14 @@ from nonebot_plugin_alconna import (
 )
 from nonebot_plugin_uninfo import Uninfo
 
+from ..bucket import StatisticsType, get_time_buckets
 from ..manager import meme_manager
 from ..plot import plot_duration_counts, plot_meme_and_duration_counts
 from ..recorder import (
     SessionIdType,
-    get_meme_generation_records,
-    get_meme_generation_times,
+    get_meme_generation_bucket_counts,
+    get_meme_generation_key_bucket_counts,
 )
-from ..utils import add_timezone
 from .utils import find_meme
 
 statistics_matcher = on_alconna(
@@ -106,7 +105,7 @@ async def _(
     meme_name: Optional[str] = None,
     query_global: Query[bool] = AlconnaQuery("global.value", False),
     query_my: Query[bool] = AlconnaQuery("my.value", False),
-    query_type: Query[str] = AlconnaQuery("type", "24h"),
+    query_type: Query[StatisticsType] = AlconnaQuery("type", "24h"),
 ):
     meme = await find_meme(matcher, meme_name) if meme_name else None
 
@@ -123,96 +122,32 @@ async def _(
     else:
         id_type = SessionIdType.GROUP
 
-    now = datetime.now().astimezone()
-    if type == "24h":
-        start = now - timedelta(days=1)
-        td = timedelta(hours=1)
-        fmt = "%H:%M"
-        humanized = "24小时"
-    elif type == "day":
-        start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        td = timedelta(hours=1)
-        fmt = "%H:%M"
-        humanized = "本日"
-    elif type == "7d":
-        start = now - timedelta(days=7)
-        td = timedelta(days=1)
-        fmt = "%m/%d"
-        humanized = "7天"
-    elif type == "week":
-        start = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(
-            days=now.weekday()
-        )
-        td = timedelta(days=1)
-        fmt = "%a"
-        humanized = "本周"
-    elif type == "30d":
-        start = now - timedelta(days=30)
-        td = timedelta(days=1)
-        fmt = "%m/%d"
-        humanized = "30天"
-    elif type == "month":
-        start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        td = timedelta(days=1)
-        fmt = "%m/%d"
-        humanized = "本月"
-    elif type == "1y":
-        start = now - relativedelta(years=1)
-        td = relativedelta(months=1)
-        fmt = "%y/%m"
-        humanized = "一年"
-    else:
-        start = now.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
-        td = relativedelta(months=1)
-        fmt = "%b"
-        humanized = "本年"
+    buckets = get_time_buckets(type, datetime.now().astimezone())
+    edges = buckets.edges
+    humanized = buckets.humanized
 
+    key_counts: dict[str, int] = {}
     if meme:
-        meme_times = await get_meme_generation_times(
-            session, id_type, meme_key=meme.key, time_start=start
+        counts = await get_meme_generation_bucket_counts(
+            session, id_type, edges, meme_key=meme.key
         )
-        meme_keys = [meme.key] * len(meme_times)
+        key_counts[meme.key] = sum(counts)
     else:
-        meme_records = await get_meme_generation_records(
-            session, id_type, time_start=start
-        )
-        meme_records = [
-            record for record in meme_records if meme_manager.get_meme(record.meme_key)
-        ]
-        meme_times = [record.time for record in meme_records]
-        meme_keys = [record.meme_key for record in meme_records]
-
-    if not meme_times:
+        counts = [0] * (len(edges) - 1)
+        for record in await get_meme_generation_key_bucket_counts(
+            session, id_type, edges
+        ):
+            if not meme_manager.get_meme(record.meme_key):
+                continue
+            counts[record.bucket] += record.count
+            key_counts[record.meme_key] = (
+                key_counts.get(record.meme_key, 0) + record.count
+            )
+
+    if not sum(counts):
         await matcher.finish("暂时没有表情调用记录")
 
-    meme_times = [add_timezone(time) for time in meme_times]
-    meme_times.sort()
-
-    def fmt_time(time: datetime) -> str:
-        if type in ["24h", "7d", "30d", "1y"]:
-            return (time + td).strftime(fmt)
-        return time.strftime(fmt)
-
-    duration_counts: dict[str, int] = {}
-    stop = start + td
-    count = 0
-    key = fmt_time(start)
-    for time in meme_times:
-        while time >= stop:
-            duration_counts[key] = count
-            key = fmt_time(stop)
-            stop += td
-            count = 0
-        count += 1
-    duration_counts[key] = count
-    while stop <= now:
-        key = fmt_time(stop)
-        stop += td
-        duration_counts[key] = 0
-
-    key_counts: dict[str, int] = {}
-    for key in meme_keys:
-        key_counts[key] = key_counts.get(key, 0) + 1
+    duration_counts: dict[str, int] = dict(zip(buckets.labels, counts))
     key_counts = dict(sorted(key_counts.items(), key=lambda item: item[1]))
 
     if meme:
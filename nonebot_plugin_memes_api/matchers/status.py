@@ -0,0 +1,45 @@
+from nonebot.matcher import Matcher
+from nonebot.permission import SUPERUSER
+from nonebot_plugin_alconna import on_alconna
+
+from ..cache import MB, result_cache
+from ..config import memes_config
+from .command import user_cache, user_fetch_stats
+
+status_matcher = on_alconna(
+    "表情缓存统计",
+    block=True,
+    priority=11,
+    use_cmd_start=True,
+    permission=SUPERUSER,
+)
+
+
+def hit_rate(hits: int, misses: int) -> str:
+    if not (total := hits + misses):
+        return "-"
+    return f"{hits / total:.1%}"
+
+
+@status_matcher.handle()
+async def _(matcher: Matcher):
+    lines: list[str] = []
+    if memes_config.memes_result_cache_enabled:
+        stats = result_cache.stats
+        lines.append(
+            f"生成结果缓存：命中 {stats['hits']} 次，未命中 {stats['misses']} 次，"
+            f"命中率 {hit_rate(stats['hits'], stats['misses'])}，"
+            f"内存 {stats['memory_size'] / MB:.1f} MB，"
+            f"磁盘 {stats['disk_size'] / MB:.1f} MB"
+        )
+    else:
+        lines.append("生成结果缓存：未启用")
+    lines.append(
+        f"用户信息缓存：命中 {user_cache.hits} 次，未命中 {user_cache.misses} 次，"
+        f"命中率 {hit_rate(user_cache.hits, user_cache.misses)}"
+    )
+    lines.append(
+        f"获取用户信息：调用适配器接口 {user_fetch_stats.adapter_calls} 次，"
+        f"失败 {user_fetch_stats.adapter_errors} 次"
+    )
+    await matcher.finish("\n".join(lines))
@@ -0,0 +1,204 @@
+"""add_generation_counts
+
+迁移 ID: 8e2b6f4a1c7d
+父迁移: 3c9f1d2e7a4b
+创建时间: 2026-10-18 00:12:41.207315
+
+"""
+
+from __future__ import annotations
+
+from collections import Counter
+from collections.abc import Callable, Sequence
+from datetime import datetime
+
+import sqlalchemy as sa
+from alembic import op
+from nonebot.log import logger
+
+revision: str = "8e2b6f4a1c7d"
+down_revision: str | Sequence[str] | None = "3c9f1d2e7a4b"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def create_count_table(table_name: str, name: str) -> sa.Table:
+    table = op.create_table(
+        table_name,
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("session_persist_id", sa.Integer(), nullable=False),
+        sa.Column("time", sa.DateTime(), nullable=False),
+        sa.Column("meme_key", sa.String(length=64), nullable=False),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("id", name=op.f(f"pk_{table_name}")),
+        sa.UniqueConstraint(
+            "session_persist_id",
+            "meme_key",
+            "time",
+            name=op.f(f"uq_memes_api_{name}_count"),
+        ),
+        info={"bind_key": "nonebot_plugin_memes_api"},
+    )
+    with op.batch_alter_table(table_name, schema=None) as batch_op:
+        batch_op.create_index(
+            batch_op.f(f"ix_memes_api_{name}_count_time"), ["time"], unique=False
+        )
+        batch_op.create_index(
+            batch_op.f(f"ix_memes_api_{name}_count_meme_key_time"),
+            ["meme_key", "time"],
+            unique=False,
+        )
+    return table
+
+
+def floor_hour(time: datetime) -> datetime:
+    return time.replace(minute=0, second=0, microsecond=0)
+
+
+def floor_day(time: datetime) -> datetime:
+    return time.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+CountKey = tuple[int, str, datetime]
+
+MIGRATION_LIMIT = 10000  # 每次读取的数据量为 10000 条
+
+
+class CountMigrator:
+    """按时间汇总调用次数并分批写入
+
+    调用记录按 id 读取，时间大致递增；早于当前批次最早时间的汇总已不会再变化，
+    随即写入数据库，内存中只保留最近一段时间的汇总。
+    少数早于已写入部分的记录单独汇总，最后再合并到已有的行中
+    """
+
+    def __init__(self, table: sa.Table, floor: Callable[[datetime], datetime]):
+        self.table = table
+        self.floor = floor
+        self.counts: Counter[CountKey] = Counter()
+        self.late_counts: Counter[CountKey] = Counter()
+        self.written_before: datetime | None = None
+
+    def add(self, records: Sequence[sa.Row]):
+        for record in records:
+            key = (record[1], record[3], self.floor(record[2]))
+            if self.written_before and key[2] < self.written_before:
+                self.late_counts[key] += 1
+            else:
+                self.counts[key] += 1
+        watermark = min(self.floor(record[2]) for record in records)
+        if self.written_before is None or watermark > self.written_before:
+            self.write([key for key in self.counts if key[2] < watermark])
+            self.written_before = watermark
+
+    def write(self, keys: list[CountKey]):
+        rows = [
+            {
+                "session_persist_id": key[0],
+                "meme_key": key[1],
+                "time": key[2],
+                "count": self.counts.pop(key),
+            }
+            for key in keys
+        ]
+        for i in range(0, len(rows), MIGRATION_LIMIT):
+            op.bulk_insert(self.table, rows[i : i + MIGRATION_LIMIT])
+
+    def finish(self):
+        self.write(list(self.counts))
+        conn = op.get_bind()
+        for (session_persist_id, meme_key, time), count in self.late_counts.items():
+            whereclause = [
+                self.table.c.session_persist_id == session_persist_id,
+                self.table.c.meme_key == meme_key,
+                self.table.c.time == time,
+            ]
+            result = conn.execute(
+                sa.update(self.table)
+                .where(*whereclause)
+                .values(count=self.table.c.count + count)
+            )
+            if not result.rowcount:
+                op.bulk_insert(
+                    self.table,
+                    [
+                        {
+                            "session_persist_id": session_persist_id,
+                            "meme_key": meme_key,
+                            "time": time,
+                            "count": count,
+                        }
+                    ],
+                )
+
+
+def data_migrate(hourly_table: sa.Table, daily_table: sa.Table) -> None:
+    conn = op.get_bind()
+    record_table = sa.table(
+        "nonebot_plugin_memes_api_memegenerationrecord_v2",
+        sa.column("id", sa.Integer()),
+        sa.column("session_persist_id", sa.Integer()),
+        sa.column("time", sa.DateTime()),
+        sa.column("meme_key", sa.String()),
+    )
+    count = conn.execute(sa.select(sa.func.count()).select_from(record_table)).scalar()
+    if not count:
+        return
+
+    last_record_id = -1
+    migrators = [
+        CountMigrator(hourly_table, floor_hour),
+        CountMigrator(daily_table, floor_day),
+    ]
+
+    logger.warning("memes-api: 正在汇总表情调用次数，请不要关闭程序...")
+
+    migrated = 0
+    while True:
+        statement = (
+            sa.select(
+                record_table.c.id,
+                record_table.c.session_persist_id,
+                record_table.c.time,
+                record_table.c.meme_key,
+            )
+            .order_by(record_table.c.id)
+            .where(record_table.c.id > last_record_id)
+            .limit(MIGRATION_LIMIT)
+        )
+        records = conn.execute(statement).all()
+        if not records:
+            break
+        last_record_id = records[-1][0]
+        for migrator in migrators:
+            migrator.add(records)
+        migrated += len(records)
+        logger.info(f"memes-api: 已汇总 {migrated}/{count}")
+
+    for migrator in migrators:
+        migrator.finish()
+
+    logger.warning("memes-api: 表情调用次数汇总完成！")
+
+
+def upgrade(name: str = "") -> None:
+    if name:
+        return
+    # ### commands auto generated by Alembic - please adjust! ###
+    hourly_table = create_count_table(
+        "nonebot_plugin_memes_api_memegenerationhourlycount", "hourly"
+    )
+    daily_table = create_count_table(
+        "nonebot_plugin_memes_api_memegenerationdailycount", "daily"
+    )
+    # ### end Alembic commands ###
+    data_migrate(hourly_table, daily_table)
+
+
+def downgrade(name: str = "") -> None:
+    if name:
+        return
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_table("nonebot_plugin_memes_api_memegenerationdailycount")
+    op.drop_table("nonebot_plugin_memes_api_memegenerationhourlycount")
+    # ### end Alembic commands ###
@@ -1,14 +1,27 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
 from io import BytesIO
+from typing import Any, Callable, Optional
 
 import matplotlib
-from matplotlib import pyplot as plt
+import matplotlib.style
 from matplotlib.axes import Axes
+from matplotlib.figure import Figure
 from matplotlib.font_manager import fontManager
 from matplotlib.ticker import MaxNLocator
+from nonebot import get_driver
+from nonebot import init as nonebot_init
+from nonebot.compat import model_dump
+from nonebot.log import logger
 from nonebot.utils import run_sync
 
+from .config import memes_config
+
 matplotlib.use("agg")
-plt.style.use("bmh")
+matplotlib.style.use("bmh")
 fallback_fonts = [
     "PingFang SC",
     "Hiragino Sans GB",
@@ -26,10 +39,17 @@ for fontfamily in fallback_fonts.copy():
 matplotlib.rcParams["font.family"] = fallback_fonts
 
 
-@run_sync
-def plot_meme_and_duration_counts(
+def save_figure(fig: Figure) -> bytes:
+    output = BytesIO()
+    fig.savefig(output, format="png", bbox_inches="tight", pad_inches=0.2)
+    # 不经过 pyplot 创建的图像不会被全局引用，清空后即可被回收
+    fig.clear()
+    return output.getvalue()
+
+
+def render_meme_and_duration_counts(
     meme_counts: dict[str, int], duration_counts: dict[str, int], title: str
-) -> BytesIO:
+) -> bytes:
     up_x = list(meme_counts.keys())
     up_y = list(meme_counts.values())
     low_x = list(duration_counts.keys())
@@ -38,12 +58,8 @@ def plot_meme_and_duration_counts(
     up_height = num * 0.3
     low_height = 3
     fig_width = 8
-    fig, axs = plt.subplots(
-        nrows=2,
-        figsize=(fig_width, up_height + low_height),
-        height_ratios=[up_height, low_height],
-        constrained_layout=True,
-    )
+    fig = Figure(figsize=(fig_width, up_height + low_height), constrained_layout=True)
+    axs = fig.subplots(nrows=2, height_ratios=[up_height, low_height])
     up: Axes = axs[0]
     up.barh(range(num), up_y, height=0.5)
     up.set_ylim(-1, num)
@@ -57,16 +73,14 @@ def plot_meme_and_duration_counts(
         low.set_xticks(low_x[::2])
     low.yaxis.set_major_locator(MaxNLocator(integer=True))
     fig.suptitle(title)
-    output = BytesIO()
-    fig.savefig(output, bbox_inches="tight", pad_inches=0.2)
-    return output
+    return save_figure(fig)
 
 
-@run_sync
-def plot_duration_counts(duration_counts: dict[str, int], title: str) -> BytesIO:
+def render_duration_counts(duration_counts: dict[str, int], title: str) -> bytes:
     x = list(duration_counts.keys())
     y = list(duration_counts.values())
-    fig, ax = plt.subplots(figsize=(6, 4), constrained_layout=True)
+    fig = Figure(figsize=(6, 4), constrained_layout=True)
+    ax = fig.subplots()
     ax.plot(x, y, marker="o")
     if len(x) > 24:
         ax.set_xticks(x[::3])
@@ -74,6 +88,83 @@ def plot_duration_counts(duration_counts: dict[str, int], title: str) -> BytesIO
         ax.set_xticks(x[::2])
     ax.yaxis.set_major_locator(MaxNLocator(integer=True))
     fig.suptitle(title)
-    output = BytesIO()
-    fig.savefig(output, bbox_inches="tight", pad_inches=0.2)
-    return output
+    return save_figure(fig)
+
+
+class PlotWorker:
+    """统计图绘制器
+
+    默认在线程中绘图；`process` 为真时在子进程中绘图，避免绘图占用机器人进程的 GIL
+    """
+
+    def __init__(self, workers: int, process: bool = False):
+        self.workers = max(workers, 1)
+        self.process = process
+        self.__executor: Optional[Executor] = None
+        self.__semaphore: Optional[asyncio.Semaphore] = None
+
+    def start(self):
+        if self.__executor is not None:
+            return
+        self.__semaphore = asyncio.Semaphore(self.workers)
+        if self.process:
+            # 机器人进程中已有其他线程，fork 可能导致子进程死锁，因此使用 spawn；
+            # 子进程导入绘图函数时会导入本插件，需先以相同的配置初始化 NoneBot
+            self.__executor = ProcessPoolExecutor(
+                self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=partial(nonebot_init, **model_dump(get_driver().config)),
+            )
+            # 提前启动子进程，避免首次绘图时等待
+            self.__executor.submit(int)
+        else:
+            self.__executor = ThreadPoolExecutor(
+                self.workers, thread_name_prefix="memes_plot"
+            )
+
+    def shutdown(self):
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=False, cancel_futures=True)
+            self.__executor = None
+
+    async def run(self, func: Callable[..., bytes], *args: Any) -> bytes:
+        self.start()
+        assert self.__executor
+        assert self.__semaphore
+        async with self.__semaphore:
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(self.__executor, func, *args)
+            except BrokenProcessPool as e:
+                logger.warning(f"绘图进程异常退出，将重新创建：{e}")
+                self.shutdown()
+                return await run_sync(func)(*args)
+
+
+plot_worker = PlotWorker(
+    memes_config.memes_plot_workers, process=memes_config.memes_plot_process
+)
+
+driver = get_driver()
+
+
+@driver.on_startup
+async def _():
+    plot_worker.start()
+
+
+@driver.on_shutdown
+async def _():
+    plot_worker.shutdown()
+
+
+async def plot_meme_and_duration_counts(
+    meme_counts: dict[str, int], duration_counts: dict[str, int], title: str
+) -> bytes:
+    return await plot_worker.run(
+        render_meme_and_duration_counts, meme_counts, duration_counts, title
+    )
+
+
+async def plot_duration_counts(duration_counts: dict[str, int], title: str) -> bytes:
+    return await plot_worker.run(render_duration_counts, duration_counts, title)
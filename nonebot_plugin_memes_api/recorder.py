@@ -1,8 +1,13 @@
+import asyncio
+from collections import Counter
+from collections.abc import AsyncIterator, Sequence
 from dataclasses import dataclass
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from enum import Enum
-from typing import Optional, Union
+from typing import Any, Optional, Union
 
+from nonebot import get_driver
+from nonebot.log import logger
 from nonebot_plugin_orm import Model, get_session
 from nonebot_plugin_uninfo import Session, SupportScope
 from nonebot_plugin_uninfo.orm import (
@@ -12,9 +17,30 @@ from nonebot_plugin_uninfo.orm import (
     UserModel,
     get_session_persist_id,
 )
-from sqlalchemy import ColumnElement, String, select
+from sqlalchemy import (
+    ColumnElement,
+    Index,
+    Row,
+    Select,
+    String,
+    UniqueConstraint,
+    and_,
+    bindparam,
+    case,
+    delete,
+    func,
+    insert,
+    literal,
+    or_,
+    select,
+    update,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Mapped, mapped_column
 
+from .cache import TTLCache
+from .config import memes_config
+from .counter import usage_counter
 from .utils import remove_timezone
 
 
@@ -22,7 +48,12 @@ class MemeGenerationRecord(Model):
     """表情调用记录"""
 
     __tablename__ = "nonebot_plugin_memes_api_memegenerationrecord_v2"
-    __table_args__ = {"extend_existing": True}
+    __table_args__ = (
+        Index("ix_memes_api_record_v2_time", "time"),
+        Index("ix_memes_api_record_v2_meme_key_time", "meme_key", "time"),
+        Index("ix_memes_api_record_v2_session_time", "session_persist_id", "time"),
+        {"extend_existing": True},
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     session_persist_id: Mapped[int]
@@ -33,23 +64,371 @@ class MemeGenerationRecord(Model):
     """ 表情名 """
 
 
+class MemeGenerationHourlyCount(Model):
+    """表情每小时调用次数"""
+
+    __tablename__ = "nonebot_plugin_memes_api_memegenerationhourlycount"
+    __table_args__ = (
+        UniqueConstraint(
+            "session_persist_id", "meme_key", "time", name="uq_memes_api_hourly_count"
+        ),
+        Index("ix_memes_api_hourly_count_time", "time"),
+        Index("ix_memes_api_hourly_count_meme_key_time", "meme_key", "time"),
+        {"extend_existing": True},
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    session_persist_id: Mapped[int]
+    """ 会话持久化id """
+    time: Mapped[datetime]
+    """ 统计时段的开始时间\n\n存放 UTC 时间 """
+    meme_key: Mapped[str] = mapped_column(String(64))
+    """ 表情名 """
+    count: Mapped[int]
+    """ 调用次数 """
+
+
+class MemeGenerationDailyCount(Model):
+    """表情每日调用次数"""
+
+    __tablename__ = "nonebot_plugin_memes_api_memegenerationdailycount"
+    __table_args__ = (
+        UniqueConstraint(
+            "session_persist_id", "meme_key", "time", name="uq_memes_api_daily_count"
+        ),
+        Index("ix_memes_api_daily_count_time", "time"),
+        Index("ix_memes_api_daily_count_meme_key_time", "meme_key", "time"),
+        {"extend_existing": True},
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    session_persist_id: Mapped[int]
+    """ 会话持久化id """
+    time: Mapped[datetime]
+    """ 统计时段的开始时间\n\n存放 UTC 时间，按 UTC 日期划分 """
+    meme_key: Mapped[str] = mapped_column(String(64))
+    """ 表情名 """
+    count: Mapped[int]
+    """ 调用次数 """
+
+
+RecordModel = Union[
+    type[MemeGenerationRecord],
+    type[MemeGenerationHourlyCount],
+    type[MemeGenerationDailyCount],
+]
+
+HOUR = timedelta(hours=1)
+DAY = timedelta(days=1)
+
+
+def floor_time(dt: datetime, unit: timedelta) -> datetime:
+    return datetime.min + (dt - datetime.min) // unit * unit
+
+
+def ceil_time(dt: datetime, unit: timedelta) -> datetime:
+    floored = floor_time(dt, unit)
+    return floored if floored == dt else floored + unit
+
+
+async def update_meme_generation_counts(
+    db_session: AsyncSession,
+    model: Union[type[MemeGenerationHourlyCount], type[MemeGenerationDailyCount]],
+    unit: timedelta,
+    records: list[dict[str, Any]],
+):
+    """将新增的调用记录累加到按时段汇总的调用次数中"""
+    counts = Counter(
+        (
+            record["session_persist_id"],
+            record["meme_key"],
+            floor_time(record["time"], unit),
+        )
+        for record in records
+    )
+    statement = select(
+        model.id, model.session_persist_id, model.meme_key, model.time
+    ).where(
+        model.session_persist_id.in_({key[0] for key in counts}),
+        model.meme_key.in_({key[1] for key in counts}),
+        model.time.in_({key[2] for key in counts}),
+    )
+    existing = {
+        (result[1], result[2], result[3]): result[0]
+        for result in (await db_session.execute(statement)).all()
+    }
+    if updates := [
+        {"row_id": existing[key], "increment": count}
+        for key, count in counts.items()
+        if key in existing
+    ]:
+        table = model.__table__
+        await db_session.execute(
+            update(table)
+            .where(table.c.id == bindparam("row_id"))
+            .values(count=table.c.count + bindparam("increment")),
+            updates,
+        )
+    if inserts := [
+        {
+            "session_persist_id": key[0],
+            "meme_key": key[1],
+            "time": key[2],
+            "count": count,
+        }
+        for key, count in counts.items()
+        if key not in existing
+    ]:
+        await db_session.execute(insert(model), inserts)
+
+
 @dataclass
 class MemeRecord:
     time: datetime
     meme_key: str
 
 
-async def record_meme_generation(session: Session, meme_key: str):
-    session_persist_id = await get_session_persist_id(session)
+@dataclass
+class MemeExportRecord:
+    id: int
+    time: datetime
+    meme_key: str
+    adapter: str
+    scope: str
+    self_id: str
+    scene_type: int
+    scene_id: str
+    user_id: str
+
+
+@dataclass
+class MemeBucketCount:
+    bucket: int
+    meme_key: str
+    count: int
+
+
+@dataclass
+class PendingRecord:
+    session: Session
+    time: datetime
+    meme_key: str
+
+
+class RecordWriter:
+    """表情调用记录写入器
+
+    调用记录先放入队列，由后台任务按数量或时间间隔批量写入数据库；
+    写入失败时间隔 `retry_delay` 秒重试，每次重试的间隔翻倍，重试 `max_retries` 次后丢弃
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        flush_interval: float,
+        queue_size: int,
+        max_retries: int = 3,
+        retry_delay: float = 1,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.__queue: Optional[asyncio.Queue[Optional[PendingRecord]]] = None
+        self.__task: Optional[asyncio.Task] = None
+        self.__ready: Optional[asyncio.Event] = None
+        self.__persist_ids: TTLCache[int] = TTLCache(max_items=4096)
+
+    def start(self):
+        if self.__task is None:
+            self.__queue = asyncio.Queue(maxsize=self.queue_size)
+            self.__ready = asyncio.Event()
+            self.__task = asyncio.create_task(self.__run())
+
+    async def stop(self):
+        if self.__task is None or self.__queue is None or self.__ready is None:
+            return
+        await self.__queue.put(None)
+        self.__ready.set()
+        await self.__task
+        self.__task = None
+        self.__queue = None
+
+    async def put(self, record: PendingRecord):
+        if self.__queue is None or self.__ready is None:
+            await self.__write([record])
+            return
+        # 队列已满时等待，避免积压过多记录
+        await self.__queue.put(record)
+        if self.__queue.qsize() >= self.batch_size:
+            self.__ready.set()
+
+    async def __run(self):
+        assert self.__queue
+        assert self.__ready
+        while True:
+            if (record := await self.__queue.get()) is None:
+                break
+            records = [record]
+            # 等待记录数量达到批量大小或超过时间间隔
+            if self.__queue.qsize() + 1 < self.batch_size:
+                self.__ready.clear()
+                try:
+                    await asyncio.wait_for(self.__ready.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            stopping = False
+            while len(records) < self.batch_size and not self.__queue.empty():
+                if (record := self.__queue.get_nowait()) is None:
+                    stopping = True
+                    break
+                records.append(record)
+            await self.__write(records)
+            if stopping:
+                break
+
+    async def __get_persist_id(self, session: Session) -> int:
+        key = (
+            scope_value(session.scope),
+            session.adapter,
+            session.self_id,
+            session.scene.type.value,
+            session.scene_path,
+            session.user.id,
+        )
+        if (persist_id := self.__persist_ids.get(key)) is None:
+            persist_id = await get_session_persist_id(session)
+            self.__persist_ids.set(key, persist_id)
+        return persist_id
+
+    async def __insert(self, records: list[PendingRecord]):
+        values = [
+            {
+                "session_persist_id": await self.__get_persist_id(record.session),
+                "time": record.time,
+                "meme_key": record.meme_key,
+            }
+            for record in records
+        ]
+        async with get_session() as db_session:
+            await db_session.execute(insert(MemeGenerationRecord), values)
+            await update_meme_generation_counts(
+                db_session, MemeGenerationHourlyCount, HOUR, values
+            )
+            await update_meme_generation_counts(
+                db_session, MemeGenerationDailyCount, DAY, values
+            )
+            await db_session.commit()
+
+    async def __write(self, records: list[PendingRecord]):
+        delay = self.retry_delay
+        for retries in range(self.max_retries + 1):
+            try:
+                await self.__insert(records)
+                return
+            except Exception as e:
+                if retries >= self.max_retries:
+                    logger.warning(
+                        f"表情调用记录写入失败，已重试 {retries} 次，"
+                        f"丢弃 {len(records)} 条记录：{e}"
+                    )
+                    return
+                logger.warning(f"表情调用记录写入失败，{delay:g} 秒后重试：{e}")
+            # 重试期间队列中的记录继续积压，队列已满时调用方会等待
+            await asyncio.sleep(delay)
+            delay *= 2
+
+
+record_writer = RecordWriter(
+    batch_size=memes_config.memes_record_batch_size,
+    flush_interval=memes_config.memes_record_flush_interval,
+    queue_size=memes_config.memes_record_queue_size,
+)
+
+
+def retention_cutoff() -> Optional[datetime]:
+    """早于该时间的调用记录会被清理"""
+    if (retention_days := memes_config.memes_record_retention_days) is None:
+        return None
+    return datetime.now(timezone.utc) - timedelta(days=retention_days)
+
+
+async def prune_meme_generation_records(
+    time_stop: datetime, batch_size: int = 10000
+) -> int:
+    """分批删除早于 `time_stop` 的调用记录
+
+    调用次数已在写入时汇总至每小时、每日调用次数中，删除后不影响统计
+    """
+    time_stop = remove_timezone(time_stop)
+    deleted = 0
+    while True:
+        async with get_session() as db_session:
+            record_ids = (
+                await db_session.scalars(
+                    select(MemeGenerationRecord.id)
+                    .where(MemeGenerationRecord.time < time_stop)
+                    .order_by(MemeGenerationRecord.id)
+                    .limit(batch_size)
+                )
+            ).all()
+            if not record_ids:
+                break
+            await db_session.execute(
+                delete(MemeGenerationRecord).where(
+                    MemeGenerationRecord.id.in_(record_ids)
+                )
+            )
+            await db_session.commit()
+        deleted += len(record_ids)
+        if len(record_ids) < batch_size:
+            break
+        # 让出事件循环，避免长时间占用数据库
+        await asyncio.sleep(0)
+    return deleted
+
+
+async def prune_periodically():
+    while True:
+        if cutoff := retention_cutoff():
+            try:
+                if deleted := await prune_meme_generation_records(cutoff):
+                    logger.info(f"已清理 {deleted} 条过期的表情调用记录")
+            except Exception as e:
+                logger.warning(f"表情调用记录清理失败：{e}")
+        await asyncio.sleep(memes_config.memes_record_prune_interval)
+
+
+driver = get_driver()
+prune_task: Optional[asyncio.Task] = None
+
+
+@driver.on_startup
+async def _():
+    global prune_task
+    record_writer.start()
+    if memes_config.memes_record_retention_days is not None:
+        prune_task = asyncio.create_task(prune_periodically())
+
+
+@driver.on_shutdown
+async def _():
+    if prune_task is not None:
+        prune_task.cancel()
+    await record_writer.stop()
+
 
-    record = MemeGenerationRecord(
-        session_persist_id=session_persist_id,
-        time=remove_timezone(datetime.now(timezone.utc)),
-        meme_key=meme_key,
+async def record_meme_generation(session: Session, meme_key: str):
+    time = datetime.now(timezone.utc)
+    usage_counter.add(
+        [counter_scope_key(session, id_type) for id_type in COUNTER_ID_TYPES],
+        meme_key,
+        time,
+    )
+    await record_writer.put(
+        PendingRecord(session=session, time=remove_timezone(time), meme_key=meme_key)
     )
-    async with get_session() as db_session:
-        db_session.add(record)
-        await db_session.commit()
 
 
 class SessionIdType(Enum):
@@ -59,10 +438,36 @@ class SessionIdType(Enum):
     GROUP_USER = 3
 
 
+COUNTER_ID_TYPES = (SessionIdType.GLOBAL, SessionIdType.GROUP)
+""" 计数器中记录的统计范围，区分用户的统计范围数量过多，只从数据库中查询 """
+
+
 def scope_value(scope: Union[str, SupportScope]) -> str:
     return scope.value if isinstance(scope, SupportScope) else scope
 
 
+def id_type_filters(id_type: SessionIdType) -> tuple[bool, bool]:
+    """统计范围是否区分场景、用户"""
+    if id_type == SessionIdType.GLOBAL:
+        return False, False
+    elif id_type == SessionIdType.GROUP:
+        return True, False
+    elif id_type == SessionIdType.USER:
+        return False, True
+    return True, True
+
+
+def counter_scope_key(session: Session, id_type: SessionIdType) -> tuple[str, ...]:
+    """计数器中的统计范围，与 `filter_statement` 的过滤条件一致"""
+    filter_scene, filter_user = id_type_filters(id_type)
+    key = [str(id_type.value), session.self_id, scope_value(session.scope)]
+    if filter_scene:
+        key.extend([str(session.scene.type.value), session.scene.id])
+    if filter_user:
+        key.append(session.user.id)
+    return tuple(key)
+
+
 def filter_statement(
     session: Session,
     id_type: SessionIdType,
@@ -70,16 +475,9 @@ def filter_statement(
     meme_key: Optional[str] = None,
     time_start: Optional[datetime] = None,
     time_stop: Optional[datetime] = None,
+    model: RecordModel = MemeGenerationRecord,
 ) -> list[ColumnElement[bool]]:
-    filter_scene = True
-    filter_user = True
-    if id_type == SessionIdType.GLOBAL:
-        filter_scene = False
-        filter_user = False
-    elif id_type == SessionIdType.GROUP:
-        filter_user = False
-    elif id_type == SessionIdType.USER:
-        filter_scene = False
+    filter_scene, filter_user = id_type_filters(id_type)
     whereclause: list[ColumnElement[bool]] = []
     whereclause.append(BotModel.self_id == session.self_id)
     whereclause.append(BotModel.scope == scope_value(session.scope))
@@ -90,80 +488,286 @@ def filter_statement(
         whereclause.append(UserModel.user_id == session.user.id)
 
     if meme_key:
-        whereclause.append(MemeGenerationRecord.meme_key == meme_key)
+        whereclause.append(model.meme_key == meme_key)
     if time_start:
-        whereclause.append(MemeGenerationRecord.time >= remove_timezone(time_start))
+        whereclause.append(model.time >= remove_timezone(time_start))
     if time_stop:
-        whereclause.append(MemeGenerationRecord.time <= remove_timezone(time_stop))
+        whereclause.append(model.time <= remove_timezone(time_stop))
     return whereclause
 
 
-async def get_meme_generation_records(
+async def iter_rows_by_id(
+    statement: Select, batch_size: int
+) -> AsyncIterator[Sequence[Row]]:
+    """按调用记录 id 分页查询，`statement` 的第一列须为 `MemeGenerationRecord.id`
+
+    每页使用单独的数据库会话，不会长时间占用连接
+    """
+    last_record_id = -1
+    while True:
+        page_statement = (
+            statement.where(MemeGenerationRecord.id > last_record_id)
+            .order_by(MemeGenerationRecord.id)
+            .limit(batch_size)
+        )
+        async with get_session() as db_session:
+            results = (await db_session.execute(page_statement)).all()
+        if not results:
+            return
+        last_record_id = results[-1][0]
+        yield results
+        if len(results) < batch_size:
+            return
+
+
+async def iter_meme_generation_records(
     session: Session,
     id_type: SessionIdType,
     *,
     meme_key: Optional[str] = None,
     time_start: Optional[datetime] = None,
     time_stop: Optional[datetime] = None,
-) -> list[MemeRecord]:
+    batch_size: int = 1000,
+) -> AsyncIterator[MemeRecord]:
+    """逐条获取调用记录，按 `batch_size` 分批查询"""
     whereclause = filter_statement(
         session, id_type, meme_key=meme_key, time_start=time_start, time_stop=time_stop
     )
     statement = (
-        select(MemeGenerationRecord.time, MemeGenerationRecord.meme_key)
+        select(
+            MemeGenerationRecord.id,
+            MemeGenerationRecord.time,
+            MemeGenerationRecord.meme_key,
+        )
         .where(*whereclause)
         .join(SessionModel, SessionModel.id == MemeGenerationRecord.session_persist_id)
         .join(BotModel, BotModel.id == SessionModel.bot_persist_id)
         .join(SceneModel, SceneModel.id == SessionModel.scene_persist_id)
         .join(UserModel, UserModel.id == SessionModel.user_persist_id)
     )
-    async with get_session() as db_session:
-        results = (await db_session.execute(statement)).all()
-    return [MemeRecord(result[0], result[1]) for result in results]
+    async for results in iter_rows_by_id(statement, batch_size):
+        for result in results:
+            yield MemeRecord(result[1], result[2])
 
 
-async def get_meme_generation_times(
-    session: Session,
-    id_type: SessionIdType,
+async def iter_meme_generation_export_records(
     *,
-    meme_key: Optional[str] = None,
     time_start: Optional[datetime] = None,
     time_stop: Optional[datetime] = None,
-) -> list[datetime]:
-    whereclause = filter_statement(
-        session, id_type, meme_key=meme_key, time_start=time_start, time_stop=time_stop
-    )
+    batch_size: int = 1000,
+) -> AsyncIterator[list[MemeExportRecord]]:
+    """分批获取所有会话的调用记录及对应的会话信息"""
+    whereclause: list[ColumnElement[bool]] = []
+    if time_start:
+        whereclause.append(MemeGenerationRecord.time >= remove_timezone(time_start))
+    if time_stop:
+        whereclause.append(MemeGenerationRecord.time < remove_timezone(time_stop))
     statement = (
-        select(MemeGenerationRecord.time)
+        select(
+            MemeGenerationRecord.id,
+            MemeGenerationRecord.time,
+            MemeGenerationRecord.meme_key,
+            BotModel.adapter,
+            BotModel.scope,
+            BotModel.self_id,
+            SceneModel.scene_type,
+            SceneModel.scene_id,
+            UserModel.user_id,
+        )
         .where(*whereclause)
         .join(SessionModel, SessionModel.id == MemeGenerationRecord.session_persist_id)
         .join(BotModel, BotModel.id == SessionModel.bot_persist_id)
         .join(SceneModel, SceneModel.id == SessionModel.scene_persist_id)
         .join(UserModel, UserModel.id == SessionModel.user_persist_id)
     )
+    async for results in iter_rows_by_id(statement, batch_size):
+        yield [MemeExportRecord(*result) for result in results]
+
+
+TimeRange = tuple[datetime, datetime, int]
+""" (开始时间, 结束时间, 区间序号) """
+
+
+def split_time_ranges(
+    edges: list[datetime], records_since: Optional[datetime] = None
+) -> tuple[list[TimeRange], list[TimeRange], list[TimeRange]]:
+    """将时间区间拆分为分别从调用记录、每小时汇总、每日汇总中查询的部分
+
+    整日的部分使用每日汇总，整小时的部分使用每小时汇总，其余部分查询调用记录；
+    早于 `records_since` 的调用记录已被清理，这部分端点向前取整到整点
+    """
+    edges = [remove_timezone(edge) for edge in edges]
+    if records_since:
+        records_since = remove_timezone(records_since)
+        edges = [
+            floor_time(edge, HOUR) if edge < records_since else edge for edge in edges
+        ]
+    records: list[TimeRange] = []
+    hours: list[TimeRange] = []
+    days: list[TimeRange] = []
+    for index, (start, stop) in enumerate(zip(edges, edges[1:])):
+        if start >= stop:
+            continue
+        hour_start, hour_stop = ceil_time(start, HOUR), floor_time(stop, HOUR)
+        if hour_start >= hour_stop:
+            records.append((start, stop, index))
+            continue
+        if start < hour_start:
+            records.append((start, hour_start, index))
+        if hour_stop < stop:
+            records.append((hour_stop, stop, index))
+        day_start, day_stop = ceil_time(hour_start, DAY), floor_time(hour_stop, DAY)
+        if day_start >= day_stop:
+            hours.append((hour_start, hour_stop, index))
+            continue
+        if hour_start < day_start:
+            hours.append((hour_start, day_start, index))
+        if day_stop < hour_stop:
+            hours.append((day_stop, hour_stop, index))
+        days.append((day_start, day_stop, index))
+    return records, hours, days
+
+
+async def get_meme_generation_bucket_counts(
+    session: Session,
+    id_type: SessionIdType,
+    edges: list[datetime],
+    *,
+    meme_key: Optional[str] = None,
+) -> list[int]:
+    """统计每个时间区间内的调用次数
+
+    `edges` 为递增的区间端点，返回长度为 `len(edges) - 1` 的列表
+    """
+    counts = [0] * (len(edges) - 1)
+    for record in await get_meme_generation_key_bucket_counts(
+        session, id_type, edges, meme_key=meme_key
+    ):
+        counts[record.bucket] += record.count
+    return counts
+
+
+async def get_meme_generation_key_bucket_counts(
+    session: Session,
+    id_type: SessionIdType,
+    edges: list[datetime],
+    *,
+    meme_key: Optional[str] = None,
+) -> list[MemeBucketCount]:
+    """统计每个时间区间内各表情的调用次数
+
+    统计范围由计数器记录且区间处于计数器记录的时段内时，直接从计数器中得出结果，
+    此时不在整点的端点按整点计算
+    """
+    if (
+        id_type in COUNTER_ID_TYPES
+        and (
+            counter_counts := usage_counter.query(
+                counter_scope_key(session, id_type), edges, meme_key=meme_key
+            )
+        )
+        is not None
+    ):
+        return [
+            MemeBucketCount(bucket, key, count)
+            for (bucket, key), count in counter_counts.items()
+        ]
+
+    records, hours, days = split_time_ranges(edges, retention_cutoff())
+    counts: Counter[tuple[int, str]] = Counter()
     async with get_session() as db_session:
-        results = (await db_session.scalars(statement)).all()
-    return list(results)
+        for model, ranges in (
+            (MemeGenerationRecord, records),
+            (MemeGenerationHourlyCount, hours),
+            (MemeGenerationDailyCount, days),
+        ):
+            if not ranges:
+                continue
+            statement = range_count_statement(
+                session, id_type, model, ranges, meme_key=meme_key
+            )
+            for result in (await db_session.execute(statement)).all():
+                counts[(result[0], result[1])] += int(result[2])
+    return [
+        MemeBucketCount(bucket, key, count) for (bucket, key), count in counts.items()
+    ]
 
 
-async def get_meme_generation_keys(
+def range_count_statement(
     session: Session,
     id_type: SessionIdType,
+    model: RecordModel,
+    ranges: list[TimeRange],
     *,
-    time_start: Optional[datetime] = None,
-    time_stop: Optional[datetime] = None,
-) -> list[str]:
-    whereclause = filter_statement(
-        session, id_type, time_start=time_start, time_stop=time_stop
+    meme_key: Optional[str] = None,
+) -> Select[tuple[int, str, int]]:
+    whereclause = filter_statement(session, id_type, meme_key=meme_key, model=model)
+    whereclause.append(
+        or_(
+            *[and_(model.time >= start, model.time < stop) for start, stop, _ in ranges]
+        )
     )
-    statement = (
-        select(MemeGenerationRecord.meme_key)
+    # 各区间按时间递增排列，找到第一个结束时间晚于记录时间的区间即可
+    bucket = (
+        case(
+            *[(model.time < stop, index) for _, stop, index in ranges[:-1]],
+            else_=ranges[-1][2],
+        )
+        if len(ranges) > 1
+        else literal(ranges[0][2])
+    )
+    count = literal(1) if model is MemeGenerationRecord else model.count  # type: ignore
+    subquery = (
+        select(bucket.label("bucket"), model.meme_key, count.label("count"))
         .where(*whereclause)
-        .join(SessionModel, SessionModel.id == MemeGenerationRecord.session_persist_id)
+        .join(SessionModel, SessionModel.id == model.session_persist_id)
         .join(BotModel, BotModel.id == SessionModel.bot_persist_id)
         .join(SceneModel, SceneModel.id == SessionModel.scene_persist_id)
         .join(UserModel, UserModel.id == SessionModel.user_persist_id)
+        .subquery()
+    )
+    # 在子查询外分组，避免不同数据库对分组表达式中参数的处理差异
+    return select(
+        subquery.c.bucket, subquery.c.meme_key, func.sum(subquery.c.count)
+    ).group_by(subquery.c.bucket, subquery.c.meme_key)
+
+
+async def get_hot_meme_keys(
+    session: Session,
+    id_type: SessionIdType,
+    threshold: int,
+    *,
+    time_start: datetime,
+    time_stop: Optional[datetime] = None,
+) -> dict[str, int]:
+    """获取时间段内调用次数不少于 `threshold` 的表情及其调用次数"""
+    time_stop = time_stop or datetime.now(timezone.utc)
+    key_counts: Counter[str] = Counter()
+    for record in await get_meme_generation_key_bucket_counts(
+        session, id_type, [time_start, time_stop]
+    ):
+        key_counts[record.meme_key] += record.count
+    return {key: count for key, count in key_counts.items() if count >= threshold}
+
+
+async def get_popular_meme_keys(
+    limit: int, *, time_start: Optional[datetime] = None
+) -> list[str]:
+    """获取所有会话中调用次数最多的表情
+
+    从每日汇总中统计，`time_start` 向前取整到所在的 UTC 日期
+    """
+    statement = (
+        select(MemeGenerationDailyCount.meme_key)
+        .group_by(MemeGenerationDailyCount.meme_key)
+        .order_by(func.sum(MemeGenerationDailyCount.count).desc())
+        .limit(limit)
     )
+    if time_start:
+        statement = statement.where(
+            MemeGenerationDailyCount.time
+            >= floor_time(remove_timezone(time_start), DAY)
+        )
     async with get_session() as db_session:
         results = (await db_session.scalars(statement)).all()
     return list(results)
@@ -1,3 +1,4 @@
+import importlib.util
 import json
 from datetime import datetime
 from typing import Any, Literal, Optional, Union, cast, overload
@@ -5,7 +6,9 @@ from typing import Any, Literal, Optional, Union, cast, overload
 import httpx
 from arclet.alconna import ArgFlag, Args, Empty, Option
 from arclet.alconna.action import Action
+from nonebot import get_driver
 from nonebot.compat import model_dump, type_validate_python
+from nonebot.log import logger
 from pydantic import BaseModel
 
 from .config import memes_config
@@ -26,6 +29,58 @@ from .exception import (
 
 BASE_URL = memes_config.meme_generator_base_url
 
+_client: Optional[httpx.AsyncClient] = None
+
+
+def create_client() -> httpx.AsyncClient:
+    http2 = memes_config.memes_http2
+    if http2 and importlib.util.find_spec("h2") is None:
+        logger.warning("未安装 `h2`，无法启用 HTTP/2，请使用 `httpx[http2]` 安装")
+        http2 = False
+
+    limits = httpx.Limits(
+        max_connections=memes_config.memes_http_max_connections,
+        max_keepalive_connections=memes_config.memes_http_max_keepalive_connections,
+        keepalive_expiry=memes_config.memes_http_keepalive_expiry,
+    )
+    transport = None
+    if uds := memes_config.meme_generator_uds:
+        transport = httpx.AsyncHTTPTransport(uds=uds, http2=http2, limits=limits)
+    return httpx.AsyncClient(
+        base_url=BASE_URL,
+        timeout=memes_config.memes_http_timeout,
+        limits=limits,
+        http2=http2,
+        transport=transport,
+    )
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_client()
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+driver = get_driver()
+
+
+@driver.on_startup
+async def _():
+    get_client()
+
+
+@driver.on_shutdown
+async def _():
+    await close_client()
+
 
 @overload
 async def send_request(
@@ -60,43 +115,43 @@ async def send_request(
     response_type: Literal["JSON", "BYTES", "TEXT"],
     **kwargs,
 ):
-    async with httpx.AsyncClient(timeout=300) as client:
-        request_method = client.post if request_type == "POST" else client.get
-        resp = await request_method(BASE_URL + router, **kwargs)
-        status_code = resp.status_code
-        if status_code == 200:
-            if response_type == "JSON":
-                return resp.json()
-            elif response_type == "BYTES":
-                return resp.content
-            else:
-                return resp.text
-        elif 520 <= status_code < 600:
-            message = resp.json()["detail"]
-            if 560 <= status_code < 570:
-                raise MemeFeedback(message)
-            elif status_code == 551:
-                raise ArgParserMismatch(message)
-            elif status_code == 552:
-                raise ArgModelMismatch(message)
-            elif 550 <= status_code < 560:
-                raise ArgMismatch(message)
-            elif status_code == 541:
-                raise ImageNumberMismatch(message)
-            elif status_code == 542:
-                raise TextNumberMismatch(message)
-            elif status_code == 543:
-                raise TextOrNameNotEnough(message)
-            elif 540 <= status_code < 550:
-                raise ParamsMismatch(message)
-            elif status_code == 531:
-                raise NoSuchMeme(message)
-            elif status_code == 532:
-                raise TextOverLength(message)
-            elif status_code == 533:
-                raise OpenImageFailed(message)
-            else:
-                raise MemeGeneratorException(message)
+    client = get_client()
+    request_method = client.post if request_type == "POST" else client.get
+    resp = await request_method(router, **kwargs)
+    status_code = resp.status_code
+    if status_code == 200:
+        if response_type == "JSON":
+            return resp.json()
+        elif response_type == "BYTES":
+            return resp.content
+        else:
+            return resp.text
+    elif 520 <= status_code < 600:
+        message = resp.json()["detail"]
+        if 560 <= status_code < 570:
+            raise MemeFeedback(message)
+        elif status_code == 551:
+            raise ArgParserMismatch(message)
+        elif status_code == 552:
+            raise ArgModelMismatch(message)
+        elif 550 <= status_code < 560:
+            raise ArgMismatch(message)
+        elif status_code == 541:
+            raise ImageNumberMismatch(message)
+        elif status_code == 542:
+            raise TextNumberMismatch(message)
+        elif status_code == 543:
+            raise TextOrNameNotEnough(message)
+        elif 540 <= status_code < 550:
+            raise ParamsMismatch(message)
+        elif status_code == 531:
+            raise NoSuchMeme(message)
+        elif status_code == 532:
+            raise TextOverLength(message)
+        elif status_code == 533:
+            raise OpenImageFailed(message)
+        else:
+            raise MemeGeneratorException(message)
 
 
 class MemeKeyWithProperties(BaseModel):
@@ -131,6 +186,12 @@ async def render_meme_list(
     )
 
 
+async def get_version() -> Optional[str]:
+    """获取 `meme-generator` 版本，后端不支持时返回 `None`"""
+    result = await send_request("/meme/version", "GET", "JSON")
+    return str(result) if result else None
+
+
 async def get_meme_keys() -> list[str]:
     return cast(list[str], await send_request("/memes/keys", "GET", "JSON"))
 
@@ -203,12 +264,39 @@ class MemeInfo(BaseModel):
     date_modified: datetime
 
 
+_meme_options: dict[str, tuple[datetime, list[Option]]] = {}
+
+
+def get_meme_options(meme: MemeInfo) -> list[Option]:
+    """获取表情的命令选项，按表情名和修改时间缓存，首次使用时构建"""
+    if (cached := _meme_options.get(meme.key)) and cached[0] == meme.date_modified:
+        return cached[1]
+    options = [
+        opt.option()
+        for opt in (
+            meme.params_type.args_type.parser_options
+            if meme.params_type.args_type
+            else []
+        )
+    ]
+    _meme_options[meme.key] = (meme.date_modified, options)
+    return options
+
+
 async def get_meme_info(meme_key: str) -> MemeInfo:
     return type_validate_python(
         MemeInfo, await send_request(f"/memes/{meme_key}/info", "GET", "JSON")
     )
 
 
+async def get_meme_infos() -> Optional[list[MemeInfo]]:
+    """批量获取表情信息，后端不支持时返回 `None`"""
+    result = await send_request("/memes/infos", "GET", "JSON")
+    if not isinstance(result, list):
+        return None
+    return [type_validate_python(MemeInfo, info) for info in result]
+
+
 async def generate_meme_preview(meme_key: str) -> bytes:
     return await send_request(f"/memes/{meme_key}/preview", "GET", "BYTES")
 
@@ -0,0 +1,32 @@
+import tempfile
+from pathlib import Path
+
+import nonebot
+import pytest
+from nonebug import NONEBOT_INIT_KWARGS, NONEBOT_START_LIFESPAN
+
+
+def pytest_configure(config: pytest.Config):
+    store_dir = Path(tempfile.mkdtemp())
+    config.stash[NONEBOT_INIT_KWARGS] = {
+        "localstore_cache_dir": store_dir / "cache",
+        "localstore_config_dir": store_dir / "config",
+        "localstore_data_dir": store_dir / "data",
+        "sqlalchemy_database_url": f"sqlite+aiosqlite:///{store_dir / 'test.db'}",
+        # 测试数据库为空，直接按模型创建表
+        "alembic_startup_check": False,
+    }
+    config.stash[NONEBOT_START_LIFESPAN] = False
+
+
+@pytest.fixture(scope="session", autouse=True)
+def load_plugin(nonebug_init: None):
+    # 插件在导入时读取配置，需在 NoneBot 初始化之后导入
+    nonebot.require("nonebot_plugin_memes_api")
+
+
+@pytest.fixture(scope="session")
+async def init_db(load_plugin: None):
+    from nonebot_plugin_orm import init_orm
+
+    await init_orm()
@@ -0,0 +1,69 @@
+"""原先表情调用统计中逐条遍历调用时间的分段方式，作为测试与耗时对比的参照"""
+
+from datetime import datetime, timedelta
+
+from dateutil.relativedelta import relativedelta
+
+TYPES = ["day", "week", "month", "year", "24h", "7d", "30d", "1y"]
+
+
+def loop_counts(type: str, now: datetime, times: list[datetime]) -> dict[str, int]:
+    """统计带时区的调用时间 `times` 在各区间内的个数，以区间标签为键"""
+    if type == "24h":
+        start = now - timedelta(days=1)
+        td = timedelta(hours=1)
+        fmt = "%H:%M"
+    elif type == "day":
+        start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        td = timedelta(hours=1)
+        fmt = "%H:%M"
+    elif type == "7d":
+        start = now - timedelta(days=7)
+        td = timedelta(days=1)
+        fmt = "%m/%d"
+    elif type == "week":
+        start = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(
+            days=now.weekday()
+        )
+        td = timedelta(days=1)
+        fmt = "%a"
+    elif type == "30d":
+        start = now - timedelta(days=30)
+        td = timedelta(days=1)
+        fmt = "%m/%d"
+    elif type == "month":
+        start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        td = timedelta(days=1)
+        fmt = "%m/%d"
+    elif type == "1y":
+        start = now - relativedelta(years=1)
+        td = relativedelta(months=1)
+        fmt = "%y/%m"
+    else:
+        start = now.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+        td = relativedelta(months=1)
+        fmt = "%b"
+
+    def fmt_time(time: datetime) -> str:
+        if type in ["24h", "7d", "30d", "1y"]:
+            return (time + td).strftime(fmt)
+        return time.strftime(fmt)
+
+    meme_times = sorted(times)
+    duration_counts: dict[str, int] = {}
+    stop = start + td
+    count = 0
+    key = fmt_time(start)
+    for time in meme_times:
+        while time >= stop:
+            duration_counts[key] = count
+            key = fmt_time(stop)
+            stop += td
+            count = 0
+        count += 1
+    duration_counts[key] = count
+    while stop <= now:
+        key = fmt_time(stop)
+        stop += td
+        duration_counts[key] = 0
+    return duration_counts
@@ -0,0 +1,40 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from tests.legacy_buckets import TYPES, loop_counts
+
+TZ = timezone(timedelta(hours=8))
+NOWS = [
+    datetime(2024, 2, 29, 13, 27, 5, tzinfo=TZ),
+    datetime(2024, 12, 31, 23, 59, 59, tzinfo=TZ),
+    datetime(2025, 1, 1, 0, 0, 0, tzinfo=TZ),
+    datetime(2025, 3, 31, 8, 0, 30, tzinfo=TZ),
+]
+
+
+def utc_array(times: list[datetime]) -> np.ndarray:
+    return np.array(
+        [time.astimezone(timezone.utc).replace(tzinfo=None) for time in times],
+        dtype="datetime64[us]",
+    )
+
+
+@pytest.mark.parametrize("now", NOWS)
+@pytest.mark.parametrize("type", TYPES)
+def test_time_buckets_match_loop(type: str, now: datetime):
+    from nonebot_plugin_memes_api.bucket import bucket_indices, get_time_buckets
+
+    buckets = get_time_buckets(type, now)  # type: ignore
+    start = buckets.edges[0]
+    rng = random.Random(f"{type}{now}")
+    # 与原先的查询相同，只统计开始时间之后的调用，包含恰好位于区间端点的时间
+    times = [start + (now - start) * rng.random() for _ in range(2000)]
+    times += [edge for edge in buckets.edges if edge <= now]
+
+    indices = bucket_indices(utc_array(times), utc_array(buckets.edges))
+    counts = np.bincount(indices[indices >= 0], minlength=len(buckets.labels))
+    result = dict(zip(buckets.labels, counts.tolist()))
+    assert result == loop_counts(type, now, times)
@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING
+
+import pytest
+
+if TYPE_CHECKING:
+    from nonebot_plugin_memes_api.counter import UsageCounter
+
+
+def hour_ceil(dt: datetime) -> int:
+    from nonebot_plugin_memes_api.counter import hour_index
+
+    hour = hour_index(dt)
+    dt = dt.astimezone(timezone.utc)
+    if dt.minute or dt.second or dt.microsecond:
+        hour += 1
+    return hour
+
+
+@pytest.fixture
+def counter(tmp_path) -> "UsageCounter":
+    from nonebot_plugin_memes_api.counter import UsageCounter
+
+    counter = UsageCounter(hours=168, path=tmp_path / "usage_counter.json")
+    # 视为启动前的时段已被完整记录
+    counter.reliable_since = counter.current_hour - counter.hours
+    return counter
+
+
+def fill(counter: "UsageCounter", now: datetime) -> list[datetime]:
+    times = [now - timedelta(minutes=37 * i) for i in range(0, 168 * 60 // 37)]
+    for time in times:
+        counter.add([("global",)], "petpet", time)
+    return times
+
+
+@pytest.mark.parametrize("type", ["day", "week", "24h", "7d"])
+def test_statistics_answered_by_counter(counter: "UsageCounter", type):
+    from nonebot_plugin_memes_api.bucket import get_time_buckets
+    from nonebot_plugin_memes_api.counter import hour_index
+
+    now = datetime.now().astimezone()
+    times = fill(counter, now)
+    edges = get_time_buckets(type, now).edges
+    result = counter.query(("global",), edges)
+    assert result is not None
+
+    hour_edges = [hour_ceil(edge) for edge in edges]
+    hour_edges[-1] = max(hour_edges[-1], counter.current_hour + 1)
+    for bucket, (start, stop) in enumerate(zip(hour_edges, hour_edges[1:])):
+        expected = sum(start <= hour_index(time) < stop for time in times)
+        assert result[(bucket, "petpet")] == expected
+
+
+def test_hot_window_answered_by_counter(counter: "UsageCounter"):
+    # 与表情列表中 `hot` 图标的默认统计时段一致
+    now = datetime.now(timezone.utc)
+    start = now.replace(minute=0, second=0, microsecond=0) - timedelta(days=7)
+    times = fill(counter, now)
+    result = counter.query(("global",), [start, now])
+    assert result is not None
+    assert result[(0, "petpet")] == sum(time >= start for time in times)
+
+
+def test_unobserved_range_not_answered(counter: "UsageCounter"):
+    now = datetime.now(timezone.utc)
+    fill(counter, now)
+    assert counter.query(("global",), [now - timedelta(days=8), now]) is None
+    counter.reliable_since = counter.current_hour
+    assert counter.query(("global",), [now - timedelta(days=1), now]) is None
+
+
+def test_dump_and_load(counter: "UsageCounter", tmp_path):
+    from nonebot_plugin_memes_api.counter import UsageCounter
+
+    now = datetime.now(timezone.utc)
+    fill(counter, now)
+    edges = [now - timedelta(days=7), now]
+    counter.save_file(counter.dump(clean=True))
+
+    loaded = UsageCounter(hours=168, path=tmp_path / "usage_counter.json")
+    loaded.load_file()
+    assert loaded.query(("global",), edges) == counter.query(("global",), edges)
+
+
+def test_expired_hours_dropped(counter: "UsageCounter"):
+    from nonebot_plugin_memes_api.counter import hour_index
+
+    now = datetime.now(timezone.utc)
+    counter.add([("global",)], "petpet", now - timedelta(hours=168))
+    counter.add([("global",)], "petpet", now)
+    start = now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=168)
+    result = counter.query(("global",), [start, now])
+    assert result is not None
+    assert result[(0, "petpet")] == 2
+
+    # 一小时后最早的一小时滑出时段，其计数被移除
+    counter.add([("global",)], "petpet", now + timedelta(hours=1))
+    hours = counter.dump(clean=True)["counts"]
+    assert sorted(hours) == [hour_index(now), hour_index(now) + 1]
+
+
+def test_dump_not_changed_by_later_records(counter: "UsageCounter"):
+    from nonebot_plugin_memes_api.counter import hour_index
+
+    now = datetime.now(timezone.utc)
+    past = now - timedelta(hours=2)
+    counter.add([("global",)], "petpet", past)
+    counter.add([("global",)], "petpet", now)
+    data = counter.dump(clean=True)
+    counter.add([("global",)], "petpet", past)
+    counter.add([("global",)], "petpet", now)
+    assert data["counts"][hour_index(past)][("global",)]["petpet"] == 1
+    assert data["counts"][hour_index(now)][("global",)]["petpet"] == 1
@@ -0,0 +1,71 @@
+from typing import Optional
+
+import pytest
+from nonebot.exception import NetworkError
+
+
+class FakeInterface:
+    def __init__(
+        self, member_error: Optional[Exception], user_error: Optional[Exception]
+    ):
+        self.member_error = member_error
+        self.user_error = user_error
+
+    async def get_member(self, scene_type, scene_id: str, user_id: str):
+        from nonebot_plugin_uninfo import Member, User
+
+        if self.member_error:
+            raise self.member_error
+        return Member(User(id=user_id), nick="nick")
+
+    async def get_user(self, user_id: str):
+        from nonebot_plugin_uninfo import User
+
+        if self.user_error:
+            raise self.user_error
+        return User(id=user_id, name="name")
+
+
+def make_session(scene_id: str):
+    from nonebot_plugin_uninfo import Scene, SceneType, Session, User
+
+    return Session(
+        self_id="1",
+        adapter="OneBot V11",
+        scope="QQClient",
+        scene=Scene(id=scene_id, type=SceneType.GROUP),
+        user=User(id="10"),
+    )
+
+
+async def test_fetch_user_counts_failed_calls():
+    from nonebot_plugin_memes_api.matchers.command import (
+        fetch_user,
+        user_cache,
+        user_fetch_stats,
+    )
+
+    calls, errors = user_fetch_stats.adapter_calls, user_fetch_stats.adapter_errors
+    hits = user_cache.hits
+
+    # 获取成员信息失败，回退到获取用户信息
+    interface = FakeInterface(NotImplementedError(), None)
+    user = await fetch_user(make_session("100"), interface, "20", True)  # type: ignore
+    assert user
+    assert user.name == "name"
+    assert user_fetch_stats.adapter_calls == calls + 2
+    assert user_fetch_stats.adapter_errors == errors + 1
+
+    # 两个接口都失败时，异常向上抛出，调用仍计入统计
+    interface = FakeInterface(NetworkError("test"), NetworkError("test"))
+    with pytest.raises(NetworkError):
+        await fetch_user(make_session("101"), interface, "20", True)  # type: ignore
+    assert user_fetch_stats.adapter_calls == calls + 4
+    assert user_fetch_stats.adapter_errors == errors + 3
+
+    # 命中缓存时不调用适配器接口
+    user = await fetch_user(make_session("100"), interface, "20", True)  # type: ignore
+    assert user
+    assert user.name == "name"
+    assert user_cache.hits == hits + 1
+    assert user_fetch_stats.adapter_calls == calls + 4
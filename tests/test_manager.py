@@ -0,0 +1,64 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+MEME_INFO = {
+    "key": "petpet",
+    "params_type": {
+        "min_images": 1,
+        "max_images": 1,
+        "min_texts": 0,
+        "max_texts": 0,
+        "default_texts": [],
+    },
+    "keywords": ["摸"],
+    "shortcuts": [],
+    "tags": [],
+    "date_created": "2024-01-01T00:00:00",
+    "date_modified": "2024-01-01T00:00:00",
+}
+
+
+async def test_init_keeps_changes_made_while_flushing(
+    monkeypatch: pytest.MonkeyPatch, tmp_path
+):
+    from nonebot_plugin_memes_api import manager as manager_module
+    from nonebot_plugin_memes_api.manager import MemeManager
+
+    async def get_version():
+        return "1.0.0"
+
+    async def get_meme_keys():
+        return ["petpet"]
+
+    monkeypatch.setattr(manager_module, "get_version", get_version)
+    monkeypatch.setattr(manager_module, "get_meme_keys", get_meme_keys)
+
+    snapshot_path = tmp_path / "meme_infos.json"
+    snapshot_path.write_text(json.dumps({"version": "1.0.0", "memes": [MEME_INFO]}))
+    manager = MemeManager(tmp_path / "meme_manager.yml", snapshot_path)
+    assert manager.load_snapshot()
+
+    write = manager._MemeManager__write  # type: ignore
+
+    def slow_write(*args):
+        time.sleep(0.2)
+        write(*args)
+
+    monkeypatch.setattr(manager, "_MemeManager__write", slow_write)
+
+    manager.block("1", "petpet")
+    init_task = asyncio.create_task(manager.init())
+    # 在写入配置期间修改
+    await asyncio.sleep(0.1)
+    manager.block("2", "petpet")
+    await init_task
+
+    assert not manager.check("1", "petpet")
+    assert not manager.check("2", "petpet")
+    await manager.flush()
+    reloaded = MemeManager(tmp_path / "meme_manager.yml", snapshot_path)
+    assert reloaded.load_snapshot()
+    assert not reloaded.check("2", "petpet")
@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+
+def make_writer(monkeypatch: pytest.MonkeyPatch, failures: int):
+    from nonebot_plugin_memes_api.recorder import RecordWriter
+
+    writer = RecordWriter(batch_size=10, flush_interval=1, queue_size=100)
+    writer.retry_delay = 0
+    attempts: list[int] = []
+
+    async def insert(records):
+        attempts.append(len(records))
+        if len(attempts) <= failures:
+            raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(writer, "_RecordWriter__insert", insert)
+    return writer, attempts
+
+
+def make_record():
+    from nonebot_plugin_uninfo import Scene, SceneType, Session, User
+
+    from nonebot_plugin_memes_api.recorder import PendingRecord
+
+    session = Session(
+        self_id="1",
+        adapter="OneBot V11",
+        scope="QQClient",
+        scene=Scene(id="100", type=SceneType.GROUP),
+        user=User(id="10"),
+    )
+    return PendingRecord(session=session, time=datetime.now(), meme_key="petpet")
+
+
+async def test_write_retried_after_failure(monkeypatch: pytest.MonkeyPatch):
+    writer, attempts = make_writer(monkeypatch, failures=2)
+    writer.start()
+    for _ in range(3):
+        await writer.put(make_record())
+    await writer.stop()
+    # 同一批记录重试至写入成功
+    assert attempts == [3, 3, 3]
+
+
+async def test_write_dropped_after_max_retries(monkeypatch: pytest.MonkeyPatch):
+    writer, attempts = make_writer(monkeypatch, failures=10)
+    writer.start()
+    await writer.put(make_record())
+    await writer.stop()
+    assert attempts == [1] * (writer.max_retries + 1)
+
+
+async def test_iter_records_pages_and_time_filter(init_db: None):
+    from nonebot_plugin_orm import get_session
+    from nonebot_plugin_uninfo import Scene, SceneType, Session, User
+    from nonebot_plugin_uninfo.orm import get_session_persist_id
+
+    from nonebot_plugin_memes_api.recorder import (
+        MemeGenerationRecord,
+        SessionIdType,
+        iter_meme_generation_records,
+    )
+
+    def make_session(scene_id: str) -> Session:
+        return Session(
+            self_id="iter",
+            adapter="OneBot V11",
+            scope="QQClient",
+            scene=Scene(id=scene_id, type=SceneType.GROUP),
+            user=User(id="10"),
+        )
+
+    session = make_session("100")
+    other = make_session("101")
+    start = datetime(2024, 1, 1)
+    times = [start + timedelta(minutes=i) for i in range(25)]
+    async with get_session() as db_session:
+        persist_id = await get_session_persist_id(session)
+        other_id = await get_session_persist_id(other)
+        db_session.add_all(
+            [
+                MemeGenerationRecord(
+                    session_persist_id=session_id, time=time, meme_key=f"m{i}"
+                )
+                for i, time in enumerate(times)
+                for session_id in (persist_id, other_id)
+            ]
+        )
+        await db_session.commit()
+
+    async def collect(**kwargs) -> list[str]:
+        return [
+            record.meme_key
+            async for record in iter_meme_generation_records(
+                session, SessionIdType.GROUP, **kwargs
+            )
+        ]
+
+    expected = [f"m{i}" for i in range(25)]
+    # 最后一页不满、恰好满页、单页容纳全部记录
+    for batch_size in (10, 5, 25, 100):
+        assert await collect(batch_size=batch_size) == expected
+    assert (
+        await collect(time_start=times[3], time_stop=times[17], batch_size=4)
+        == expected[3:18]
+    )